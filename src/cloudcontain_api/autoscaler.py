@@ -0,0 +1,336 @@
+"""
+Background autoscaler for job nodes. Reads the job queue depth and node state on a
+timer and launches or terminates EC2 nodes, so job submission never touches EC2.
+Besides reacting to the queue it keeps a pool of warm idle nodes and launches nodes
+ahead of the demand predicted from job history.
+
+Run with `python -m cloudcontain_api.autoscaler`.
+"""
+import logging
+import math
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from cloudcontain_api.utils.constants import (
+    AUTOSCALER_INTERVAL,
+    JOB_NODE_AMI_ID,
+    MONGO_CONN_STRING,
+    MONGO_DB_NAME,
+    NODE_BOOT_SECONDS,
+    NODE_IDLE_TIMEOUT,
+    NODE_INSTANCE_TYPE,
+    NODE_JOBS_PER_NODE,
+    NODE_LAUNCH_TIMEOUT,
+    NODE_MAX_COUNT,
+    NODE_MODEL_REFRESH,
+    NODE_MODEL_WEEKS,
+    NODE_PRESCALE_MIN_RATE,
+    NODE_WARM_MIN,
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUED_STATUSES = ["STARTING_NODE", "PENDING"]
+FINISHED_STATUSES = ["COMPLETED", "FAILED", "BUILD_FAILED"]
+
+
+def get_desired_nodes(queue_depth):
+    """
+    Nodes needed for the queue: one as soon as anything is queued, plus one more for
+    every `NODE_JOBS_PER_NODE` jobs waiting.
+    """
+    if queue_depth == 0:
+        return 0
+    return min(NODE_MAX_COUNT, queue_depth // NODE_JOBS_PER_NODE + 1)
+
+
+def get_target_nodes(queue_depth, busy, predicted, warm_min=NODE_WARM_MIN):
+    """
+    Node count to scale toward: enough for the queue, for every busy node plus
+    `warm_min` idle ones, and for the predicted demand, capped at `NODE_MAX_COUNT`.
+    """
+    return min(NODE_MAX_COUNT, max(get_desired_nodes(queue_depth), busy + warm_min, predicted))
+
+
+class DemandModel:
+    """
+    Job submission rates per weekday and hour, averaged over the weeks of history the
+    model was built from, and the mean job duration in seconds.
+    """
+
+    def __init__(self, rates=None, mean_duration=0.0):
+        self.rates = rates or {}
+        self.mean_duration = mean_duration
+
+    @classmethod
+    def from_jobs(cls, jobs, until, weeks=NODE_MODEL_WEEKS):
+        history = jobs.aggregate([
+            {"$match": {"queued": {"$gte": until - timedelta(weeks=weeks), "$lt": until}}},
+            {
+                "$group": {
+                    "_id": {"day": {"$dayOfWeek": "$queued"}, "hour": {"$hour": "$queued"}},
+                    "count": {"$sum": 1},
+                    "duration": {"$avg": {"$subtract": ["$ended", "$started"]}},
+                }
+            },
+        ])
+
+        rates = {}
+        total_count = 0
+        total_duration = 0.0
+        for bucket in history:
+            # $dayOfWeek counts from Sunday = 1; datetime.weekday() from Monday = 0
+            weekday = (bucket["_id"]["day"] + 5) % 7
+            rates[(weekday, bucket["_id"]["hour"])] = bucket["count"] / weeks
+            if bucket["duration"] is not None:
+                total_count += bucket["count"]
+                total_duration += bucket["duration"] / 1000 * bucket["count"]
+
+        return cls(rates, total_duration / total_count if total_count else 0.0)
+
+    def rate(self, at):
+        """
+        Expected job submissions per hour at `at`.
+        """
+        return self.rates.get((at.weekday(), at.hour), 0.0)
+
+    def predicted_nodes(self, now, boot_seconds=NODE_BOOT_SECONDS):
+        """
+        Nodes needed for the busier of the current hour and the hour a node launched
+        now would come up in: the expected number of concurrent jobs (arrival rate
+        times mean duration), or none for hours below `NODE_PRESCALE_MIN_RATE`.
+        """
+        rate = max(self.rate(now), self.rate(now + timedelta(seconds=boot_seconds)))
+        if rate < NODE_PRESCALE_MIN_RATE:
+            return 0
+        return math.ceil(rate * self.mean_duration / 3600)
+
+
+class NodeAutoscaler:
+    """
+    Scales the `nodes` collection toward the queue's demand, a pool of `warm_min`
+    idle nodes, and the demand predicted by a `DemandModel` rebuilt from job history
+    every `NODE_MODEL_REFRESH` seconds. Scale-up happens as soon as the target
+    exceeds the live and pending nodes; scale-down only retires nodes that have had
+    no active job for `NODE_IDLE_TIMEOUT` seconds, so a queue hovering around a
+    threshold does not flap nodes up and down.
+
+    Launches are idempotent: the node document is written first and its ID is the
+    EC2 `ClientToken`, so a launch retried after a failure or crash never starts a
+    second instance. A lease in `locks` keeps concurrent loops from acting at once.
+    """
+
+    def __init__(self, db, ec2, warm_min=NODE_WARM_MIN, model=None, lease_seconds=None):
+        self.db = db
+        self.ec2 = ec2
+        self.warm_min = warm_min
+        self.holder = str(uuid.uuid4())
+        self.lease_seconds = lease_seconds or AUTOSCALER_INTERVAL * 3
+
+        # A model passed in is used as is; otherwise one is built from job history
+        self.model = model
+        self.refresh_model = model is None
+        self.model_built = None
+
+    def get_model(self, now):
+        if self.refresh_model and (
+            self.model_built is None
+            or (now - self.model_built).total_seconds() >= NODE_MODEL_REFRESH
+        ):
+            self.model = DemandModel.from_jobs(self.db["jobs"], now)
+            self.model_built = now
+        return self.model
+
+    def acquire_lease(self, now):
+        try:
+            lease = self.db["locks"].find_one_and_update(
+                {
+                    "_id": "autoscaler",
+                    "$or": [{"holder": self.holder}, {"expires": {"$lt": now}}],
+                },
+                {"$set": {"holder": self.holder, "expires": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another loop holds an unexpired lease
+            return False
+        return lease["holder"] == self.holder
+
+    def step(self, now=None):
+        """
+        Runs one scaling pass and returns the (launched, terminated) node counts.
+        """
+        now = now or datetime.now(timezone.utc)
+        if not self.acquire_lease(now):
+            return 0, 0
+
+        nodes = self.db["nodes"]
+        jobs = self.db["jobs"]
+
+        queue_depth = jobs.count_documents({"status": {"$in": QUEUED_STATUSES}})
+        busy_nodes = self.get_busy_nodes()
+
+        terminated = self.reap_stalled_launches(now)
+        self.retry_launches()
+        self.mark_idle(busy_nodes, now)
+
+        current = nodes.count_documents({"$or": [{"alive": True}, {"pending": True}]})
+        predicted = self.get_model(now).predicted_nodes(now)
+        desired = get_target_nodes(queue_depth, len(busy_nodes), predicted, self.warm_min)
+
+        launched = 0
+        for _ in range(desired - current):
+            self.launch_node(now)
+            launched += 1
+
+        if desired < current:
+            terminated += self.retire_idle_nodes(current - desired, now)
+
+        return launched, terminated
+
+    def get_busy_nodes(self):
+        """
+        IDs of the nodes running a job. Jobs may name their node by its ID, as an
+        ObjectId or a string, or by its EC2 instance ID.
+        """
+        names = self.db["jobs"].distinct(
+            "node",
+            {"status": {"$nin": FINISHED_STATUSES + QUEUED_STATUSES}, "node": {"$ne": None}},
+        )
+        node_ids = [ObjectId(name) for name in names if ObjectId.is_valid(name)]
+        instance_ids = [name for name in names if isinstance(name, str)]
+        return {
+            node["_id"]
+            for node in self.db["nodes"].find(
+                {"$or": [{"_id": {"$in": node_ids}}, {"instanceId": {"$in": instance_ids}}]},
+                {"_id": 1},
+            )
+        }
+
+    def launch_node(self, now):
+        node_id = self.db["nodes"].insert_one(
+            {
+                "pending": True,
+                "alive": False,
+                "launched": now,
+                "started": None,
+                "idleSince": None,
+                "instanceId": None,
+                "instanceType": None,
+                "instanceRegion": None,
+            }
+        ).inserted_id
+        self.run_instance(node_id)
+
+    def retry_launches(self):
+        # Node documents written before a failed or interrupted run_instances call
+        for node in self.db["nodes"].find({"pending": True, "instanceId": None}, {"_id": 1}):
+            self.run_instance(node["_id"])
+
+    def run_instance(self, node_id):
+        try:
+            response = self.ec2.run_instances(
+                ImageId=JOB_NODE_AMI_ID,
+                InstanceType=NODE_INSTANCE_TYPE,
+                KeyName="cloudcontain",
+                MinCount=1,
+                MaxCount=1,
+                ClientToken=str(node_id),
+                IamInstanceProfile={"Name": "EC2_CC_Node"},
+                TagSpecifications=[
+                    {
+                        "ResourceType": "instance",
+                        "Tags": [
+                            {
+                                "Key": "Name",
+                                "Value": f"CC-APP-NODE-{str(node_id)[-5:]}",
+                            }
+                        ],
+                    }
+                ],
+            )
+        except Exception:
+            # Retried with the same ClientToken on the next pass
+            return
+
+        self.db["nodes"].update_one(
+            {"_id": node_id},
+            {"$set": {
+                "instanceId": response["Instances"][0]["InstanceId"],
+                "instanceType": NODE_INSTANCE_TYPE,
+            }},
+        )
+
+    def mark_idle(self, busy_nodes, now):
+        nodes = self.db["nodes"]
+        nodes.update_many(
+            {"alive": True, "_id": {"$in": list(busy_nodes)}},
+            {"$set": {"idleSince": None}},
+        )
+        nodes.update_many(
+            {"alive": True, "_id": {"$nin": list(busy_nodes)}, "idleSince": None},
+            {"$set": {"idleSince": now}},
+        )
+
+    def retire_idle_nodes(self, count, now):
+        cutoff = now - timedelta(seconds=NODE_IDLE_TIMEOUT)
+        idle_nodes = self.db["nodes"].find(
+            {"alive": True, "idleSince": {"$lte": cutoff}, "instanceId": {"$ne": None}},
+            sort=[("idleSince", 1)],
+            limit=count,
+        )
+        return sum(self.terminate_node(node) for node in idle_nodes)
+
+    def reap_stalled_launches(self, now):
+        cutoff = now - timedelta(seconds=NODE_LAUNCH_TIMEOUT)
+        stalled = self.db["nodes"].find({"pending": True, "alive": False, "launched": {"$lte": cutoff}})
+        return sum(self.terminate_node(node) for node in stalled)
+
+    def find_launched_instances(self, node_id):
+        # A launch whose response was lost may still have started an instance
+        response = self.ec2.describe_instances(
+            Filters=[
+                {"Name": "client-token", "Values": [str(node_id)]},
+                {"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]},
+            ]
+        )
+        return [
+            instance["InstanceId"]
+            for reservation in response["Reservations"]
+            for instance in reservation["Instances"]
+        ]
+
+    def terminate_node(self, node):
+        try:
+            if node.get("instanceId"):
+                instance_ids = [node["instanceId"]]
+            else:
+                instance_ids = self.find_launched_instances(node["_id"])
+            if instance_ids:
+                self.ec2.terminate_instances(InstanceIds=instance_ids)
+        except Exception as e:
+            logger.warning("Could not terminate node %s: %s", node["_id"], e)
+            return 0
+        self.db["nodes"].delete_one({"_id": node["_id"]})
+        return 1
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                logger.exception("Autoscaler pass failed")
+            time.sleep(AUTOSCALER_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    NodeAutoscaler(db, boto3.client("ec2", region_name="us-west-1")).run()
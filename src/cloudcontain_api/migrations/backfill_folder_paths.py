@@ -0,0 +1,32 @@
+"""
+Backfills the materialized `path` of every folder in each container's embedded
+`folders` map.
+
+Run with `python -m cloudcontain_api.migrations.backfill_folder_paths`.
+"""
+from pymongo import MongoClient
+
+from cloudcontain_api.utils.constants import MONGO_CONN_STRING, MONGO_DB_NAME
+from cloudcontain_api.utils.utils import build_folder_path
+
+
+def backfill_folder_paths(db):
+    containers = db["containers"]
+    updated = 0
+
+    for container in containers.find({}, {"folders": 1}):
+        folders = container.get("folders") or {}
+        updates = {
+            f"folders.{folder_id}.path": build_folder_path(folder_id, folders)
+            for folder_id in folders
+        }
+        if updates:
+            containers.update_one({"_id": container["_id"]}, {"$set": updates})
+            updated += 1
+
+    return updated
+
+
+if __name__ == "__main__":
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    print(f"Backfilled folder paths for {backfill_folder_paths(db)} containers.")
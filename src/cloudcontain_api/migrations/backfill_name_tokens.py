@@ -0,0 +1,33 @@
+"""
+Backfills the `nameTokens` search field on containers and files.
+
+Run with `python -m cloudcontain_api.migrations.backfill_name_tokens`.
+"""
+from pymongo import MongoClient, UpdateOne
+
+from cloudcontain_api.utils.constants import MONGO_CONN_STRING, MONGO_DB_NAME
+from cloudcontain_api.utils.utils import get_name_tokens
+
+
+def backfill_name_tokens(db, batch_size=1000):
+    updated = 0
+
+    for collection in (db["containers"], db["files"]):
+        batch = []
+        for document in collection.find({}, {"name": 1}):
+            batch.append(UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {"nameTokens": get_name_tokens(document["name"])}},
+            ))
+            if len(batch) >= batch_size:
+                updated += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+
+    return updated
+
+
+if __name__ == "__main__":
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    print(f"Backfilled name tokens on {backfill_name_tokens(db)} documents.")
@@ -0,0 +1,16 @@
+"""
+Recomputes the `usage` documents behind the container and job quotas, and each
+container's size, from the containers, jobs and files collections. Seeds usage for
+users whose containers and jobs predate the counters, and corrects any drift since.
+
+Run with `python -m cloudcontain_api.migrations.backfill_usage`.
+"""
+from pymongo import MongoClient
+
+from cloudcontain_api.utils.constants import MONGO_CONN_STRING, MONGO_DB_NAME
+from cloudcontain_api.utils.usage import recompute_container_sizes, reconcile_usage
+
+if __name__ == "__main__":
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    print(f"Backfilled usage for {reconcile_usage(db)} users.")
+    print(f"Repaired the size of {recompute_container_sizes(db)} containers.")
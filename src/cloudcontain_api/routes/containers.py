@@ -1,16 +1,29 @@
-import json
-from datetime import datetime, timedelta, timezone
-import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 from bson import ObjectId
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from flask import current_app as app
-
-from cloudcontain_api.utils.auth import require_auth
-from cloudcontain_api.utils.constants import (
-    JOB_NODE_AMI_ID,
-    S3_BUCKET_NAME,
-    SQS_URL,
+from werkzeug.utils import secure_filename
+
+from cloudcontain_api.utils.access_logs import access_log_buffer
+from cloudcontain_api.utils.archive import ARCHIVE_FORMATS, stream_archive
+from cloudcontain_api.utils.auth import require_auth, require_container_access
+from cloudcontain_api.utils.outbox import build_job_outbox_entry, job_dispatcher
+from cloudcontain_api.utils.usage import (
+    count_recent_jobs,
+    record_job,
+    release_container,
+    release_jobs,
+    reserve_container,
+)
+from cloudcontain_api.utils.utils import (
+    get_name_tokens,
+    get_path,
+    get_search_pipeline,
+    get_subtree,
+    purge_s3_prefix,
+    run_in_transaction,
 )
 
 containers_bp = Blueprint("containers", __name__)
@@ -27,8 +40,7 @@ def create_container():
     if "name" not in data or not data["name"].strip():
         return jsonify({"message": "Please provide a valid container name."}), 400
     
-    owned_containers = col.count_documents({"owner": request.user["sub"]})
-    if owned_containers >= 3:
+    if not reserve_container(app.db["usage"], request.user["sub"], 3):
         return jsonify(
             {"message": "You have reached the limit of 3 free containers."}
         ), 403
@@ -37,6 +49,7 @@ def create_container():
         {
             "owner": request.user["sub"],
             "name": data["name"],
+            "nameTokens": get_name_tokens(data["name"]),
             "description": None,
             "created": timestamp,
             "lastModified": timestamp,
@@ -51,6 +64,7 @@ def create_container():
     if insert.inserted_id:
         return jsonify({"containerId": str(insert.inserted_id)}), 201
     else:
+        release_container(app.db["usage"], request.user["sub"])
         return jsonify({"message": "Error creating container."}), 500
 
 
@@ -135,106 +149,81 @@ def list_recent_containers():
 
     return jsonify(formatted_results), 200
 
+
 @containers_bp.route("/containers/<container_id>", methods=["GET"])
 @require_auth
+@require_container_access(
+    fields=("name", "description", "size", "created", "lastModified", "entryPoint"),
+    action="access this container",
+)
 def get_container(container_id):
-    containers = app.db["containers"]
-    access_logs = app.db["access_logs"]
-
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
+    container = request.container
 
-    if container:
+    access_log_buffer.record(
+        request.user["sub"], ObjectId(container_id), datetime.now(timezone.utc)
+    )
 
-        timestamp = datetime.now(timezone.utc)
-        access_logs.update_one(
-            { "containerId": ObjectId(container_id), "userId": request.user["sub"] },
-            { "$set": { "lastAccessed": timestamp } },
-            upsert=True
-        )
+    return jsonify(
+        {
+            "containerId": str(container["_id"]),
+            "owner": container["owner"],
+            "name": container["name"],
+            "description": container["description"],
+            "size": int(container["size"]),
+            "created": container["created"],
+            "lastModified": str(container["lastModified"]),
+            "public": container["public"],
+            "entryPoint": str(container["entryPoint"]),
+        }
+    ), 200
 
-        return jsonify(
-            {
-                "containerId": str(container["_id"]),
-                "owner": container["owner"],
-                "name": container["name"],
-                "description": container["description"],
-                "size": int(container["size"]),
-                "created": container["created"],
-                "lastModified": str(container["lastModified"]),
-                "public": container["public"],
-                "entryPoint": str(container["entryPoint"]),
-            }
-        ), 200
-    
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to access this container."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
-        
 
 @containers_bp.route("/containers/<container_id>", methods=["PUT"])
 @require_auth
+@require_container_access(owner=True, action="modify this container")
 def update_container(container_id):
     data = request.get_json()
     col = app.db["containers"]
 
     timestamp = datetime.now(timezone.utc)
 
-    container = col.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
-    )
+    updates = {}
 
-    if container:
-        updates = {}
+    if "entryPoint" in data and data["entryPoint"]:
+        updates["entryPoint"] = ObjectId(data["entryPoint"])
 
-        if "entryPoint" in data and data["entryPoint"]:
-            updates["entryPoint"] = ObjectId(data["entryPoint"])
+    if "name" in data and data["name"]:
+        updates["name"] = data["name"].strip()
+        updates["nameTokens"] = get_name_tokens(updates["name"])
 
-        if "name" in data and data["name"]:
-            updates["name"] = data["name"].strip()
+    if "description" in data and data["description"]:
+        updates["description"] = data["description"].strip()
+    
+    if "public" in data and data["public"] is not None:
+        try:
+            updates["public"] = bool(data["public"])
+        except ValueError:
+            return jsonify({"message": "Public must be specified as a boolean value."}), 400
 
-        if "description" in data and data["description"]:
-            updates["description"] = data["description"].strip()
-        
-        if "public" in data and data["public"] is not None:
-            try:
-                updates["public"] = bool(data["public"])
-            except ValueError:
-                return jsonify({"message": "Public must be specified as a boolean value."}), 400
-
-        if updates:
-            col.update_one(
-                {"_id": ObjectId(container_id)},
-                {
-                    "$set": {
-                        "lastModified": timestamp,
-                        **updates,
-                    }
-                },
-            )
-            return jsonify({"message": "Container updated."}), 204
-        
-        else:
-            return jsonify({"message": "No valid updates provided."}), 400
-        
-    elif col.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to modify this container."
-        }), 401
+    if updates:
+        col.update_one(
+            {"_id": ObjectId(container_id)},
+            {
+                "$set": {
+                    "lastModified": timestamp,
+                    **updates,
+                }
+            },
+        )
+        return jsonify({"message": "Container updated."}), 204
+    
     else:
-        return jsonify({"message": "Container not found."}), 404
-        
+        return jsonify({"message": "No valid updates provided."}), 400
+
 
 @containers_bp.route("/containers/<container_id>", methods=["DELETE"])
 @require_auth
+@require_container_access(owner=True, action="delete this container")
 def delete_container(container_id):
     containers = app.db["containers"]
     folders = app.db["folders"]
@@ -243,126 +232,118 @@ def delete_container(container_id):
     logs = app.db["logs"]
     access_logs = app.db["access_logs"]
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
-    )
+    try:
+        failed_keys = purge_s3_prefix(f"{container_id}/")
+    except Exception as e:
+        return jsonify({"message": f"Error deleting container files from S3. {e}"}), 500
 
-    if container:
-        
-        try:
-            bucket = app.s3.Bucket(S3_BUCKET_NAME)
-            to_delete = bucket.objects.filter(Prefix=f"{container_id}/")
-            delete_keys = [{"Key": obj.key} for obj in to_delete]
-            if delete_keys:
-                bucket.delete_objects(Delete={"Objects": delete_keys})
-        except Exception as e:
-            return jsonify({"message": f"Error deleting container files from S3. {e}"}), 500
-
-        files.delete_many({"containerId": ObjectId(container_id)})
-        folders.delete_many({"containerId": ObjectId(container_id)})
-        jobs.delete_many({"containerId": ObjectId(container_id)})
-        logs.delete_many({"containerId": ObjectId(container_id)})
-        access_logs.delete_many({"containerId": ObjectId(container_id)})
-
-        containers.delete_one({"_id": ObjectId(container_id)})
-        
-        return '', 204
-    
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
+    if failed_keys:
         return jsonify({
-            "message": "User is not authorized to delete this container."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
-        
+            "message": "Error deleting some container files from S3.",
+            "failed": [
+                {"key": key, "error": error}
+                for key, error in failed_keys.items()
+            ],
+        }), 500
+
+    release_jobs(app.db["usage"], jobs, ObjectId(container_id), datetime.now(timezone.utc))
+    with ThreadPoolExecutor() as executor:
+        deletes = [
+            executor.submit(col.delete_many, {"containerId": ObjectId(container_id)})
+            for col in (files, folders, jobs, logs, access_logs)
+        ]
+        for delete in deletes:
+            delete.result()
+
+    containers.delete_one({"_id": ObjectId(container_id)})
+    access_log_buffer.discard(ObjectId(container_id))
+    release_container(app.db["usage"], request.user["sub"])
+    
+    return '', 204
+
+
+@containers_bp.route("/containers/<container_id>/archive", methods=["GET"])
+@require_auth
+@require_container_access(fields=("name", "folders"), action="download this container")
+def download_container(container_id):
+    archive_format = request.args.get("format", "zip")
+    folder_id = request.args.get("folder", "~")
+
+    timestamp = datetime.now(timezone.utc)
+
+    container = request.container
+
+    if archive_format not in ARCHIVE_FORMATS:
+        return jsonify({"message": "Archive format must be zip or tar.gz."}), 400
+
+    scope_path = get_path(folder_id, container, include_all=False)
+    if scope_path == -1:
+        return jsonify({"message": "Folder not found within this container."}), 404
+
+    folder_ids, subtree_files = get_subtree(folder_id, container, app.db["files"])
+
+    # Entries are rooted at the downloaded folder, named after it
+    root = secure_filename(scope_path[-1] if scope_path else container["name"]) or "project"
+
+    def get_entry_name(cur_folder, name=None):
+        path = get_path(cur_folder, container, include_all=False)[len(scope_path):]
+        return "/".join([root, *path, *([name] if name else [])])
+
+    archive_folders = [(get_entry_name(cur_id), timestamp) for cur_id in folder_ids]
+    archive_files = [
+        {
+            "name": get_entry_name(file["folder"], file["name"]),
+            "key": file["key"],
+            "modified": file["lastModified"].replace(tzinfo=timezone.utc),
+        }
+        for file in subtree_files
+    ]
+
+    content_type, extension = ARCHIVE_FORMATS[archive_format]
+    return Response(
+        stream_with_context(stream_archive(
+            app.s3.meta.client, archive_format, archive_folders, archive_files
+        )),
+        content_type=content_type,
+        headers={"Content-Disposition": f'attachment; filename="{root}{extension}"'},
+    )
+
 
 @containers_bp.route("/containers/<container_id>/execute", methods=["POST"])
 @require_auth
+@require_container_access(action="execute this container")
 def execute_container(container_id):
-    containers = app.db["containers"]
     jobs = app.db["jobs"]
-    nodes = app.db["nodes"]
+    usage = app.db["usage"]
+    queued_time = datetime.now(timezone.utc)
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-        active_jobs = jobs.count_documents({
-            "containerId": ObjectId(container_id), 
-            "status": {"$nin": ["COMPLETED", "FAILED", "BUILD_FAILED"]}, 
-        })
-        if active_jobs > 0:
-            return jsonify(
-                {"message": "Container already has an active job running or queued."}
-            ), 400
-        
-        jobs_last_month = jobs.count_documents({
-            "requestedBy": request.user["sub"],
-            "queued": {"$gte": datetime.now(timezone.utc) - timedelta(days=30)}
-        })
-        if jobs_last_month >= 50:
-            return jsonify(
-                {"message": "You have reached the limit of 50 jobs in the last 30 days."}
-            ), 429
-        
-        job_status = "PENDING"
-        node_count = nodes.count_documents({"$or": [{"alive": True}, {"pending": True}]})
-        queued_jobs = jobs.count_documents({
-            "status": {"$in": ["STARTING_NODE", "PENDING"]}
-        })
-
-        if (node_count == 0 or queued_jobs >= 20) and node_count < 3:
-            insert_node_response = nodes.insert_one(
-                {
-                    "pending": True,
-                    "alive": False,
-                    "launched": datetime.now(timezone.utc),
-                    "started": None,
-                    "instanceId": None,
-                    "instanceType": None,
-                    "instanceRegion": None,
-                }
-            )
-
-            if insert_node_response.inserted_id:
-                node_tag = str(insert_node_response.inserted_id)[-5:]
-                app.ec2.run_instances(
-                    ImageId=JOB_NODE_AMI_ID,
-                    InstanceType="t3.small",
-                    KeyName="cloudcontain",
-                    MinCount=1,
-                    MaxCount=1,
-                    IamInstanceProfile={"Name": "EC2_CC_Node"},
-                    TagSpecifications=[
-                        {
-                            "ResourceType": "instance",
-                            "Tags": [
-                                {
-                                    "Key": "Name",
-                                    "Value": f"CC-APP-NODE-{node_tag}",
-                                }
-                            ],
-                        }
-                    ],
-                )
-                job_status = "STARTING_NODE"
-            else:
-                return jsonify(
-                    {"message": "Error starting node. Please try again later."}
-                ), 500
-        else:
-            node = nodes.find_one({"alive": False, "pending": True})
-            if node:
-                job_status = "STARTING_NODE"
-            
-        queued_time = datetime.now(timezone.utc)
-        insert_job_response = jobs.insert_one(
+    # Job completion is recorded by the nodes, so this stays a lookup on jobs
+    active_job = jobs.find_one(
+        {
+            "containerId": ObjectId(container_id),
+            "status": {"$nin": ["COMPLETED", "FAILED", "BUILD_FAILED"]},
+        },
+        {"_id": 1},
+    )
+    if active_job:
+        return jsonify(
+            {"message": "Container already has an active job running or queued."}
+        ), 400
+    
+    user_usage = usage.find_one({"_id": request.user["sub"]})
+    if count_recent_jobs(user_usage, queued_time) >= 50:
+        return jsonify(
+            {"message": "You have reached the limit of 50 jobs in the last 30 days."}
+        ), 429
+    
+    # Nodes are launched by the autoscaler from the queue depth
+    job_status = "PENDING"
+    job_id = ObjectId()
+
+    def queue_job(session):
+        jobs.insert_one(
             {
+                "_id": job_id,
                 "containerId": ObjectId(container_id),
                 "status": job_status,
                 "queued": queued_time,
@@ -370,65 +351,32 @@ def execute_container(container_id):
                 "ended": None,
                 "requestedBy": request.user["sub"],
                 "node": None,
-            }
+            },
+            session=session,
         )
+        # Delivered to Pusher and SQS by the job dispatcher
+        app.db["outbox"].insert_one(
+            build_job_outbox_entry(job_id, container_id, job_status, queued_time),
+            session=session,
+        )
+        record_job(usage, request.user["sub"], user_usage, queued_time, session=session)
+
+    run_in_transaction(queue_job)
+    job_dispatcher.notify()
+
+    return jsonify(
+        {
+            "jobId": str(job_id),
+            "status": job_status,
+            "queued": str(queued_time),
+            "started": None,
+            "ended": None,
+            "node": None,
+            "logCount": 0,
+            "output": [],
+        }
+    ), 201
 
-        if insert_job_response.inserted_id:
-            # Notify Pusher than job has been queued for containerId
-            job_id = str(insert_job_response.inserted_id)
-            app.pusher.trigger(
-                container_id,
-                "job-queued",
-                {
-                    "jobId": job_id,
-                    "status": job_status,
-                    "queued": str(queued_time),
-                    "started": None,
-                    "ended": None,
-                    "node": None,
-                    "output": [],
-                },
-            )
-
-            # Insert job into SQS queue
-            app.sqs.send_message(
-                QueueUrl=SQS_URL,
-                MessageBody=json.dumps(
-                    {
-                        "jobId": job_id,
-                        "containerId": container_id,
-                        "queued": str(queued_time),
-                    }
-                ),
-                MessageGroupId=container_id,
-                MessageDeduplicationId=job_id,
-            )
-
-            return jsonify(
-                {
-                    "jobId": job_id,
-                    "status": job_status,
-                    "queued": str(queued_time),
-                    "started": None,
-                    "ended": None,
-                    "node": None,
-                    "logCount": 0,
-                    "output": [],
-                }
-            ), 201
-        
-        else:
-            return jsonify(
-                {"message": "Error queuing job. Please try again later."}
-            ), 500
-        
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to execute this container."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
-    
 
 @containers_bp.route("/containers/search", methods=["POST"])
 @require_auth
@@ -440,24 +388,10 @@ def search_containers():
     if "query" not in data or not data["query"].strip():
         return jsonify({"message": "Please provide a valid search query."}), 400
         
-    query = re.compile(re.escape(data["query"]), re.IGNORECASE)
-    query_result = containers.aggregate([
-        {
-            "$match": {
-                "owner": request.user["sub"],
-                "name": query,
-            }
-        },
-        { "$limit": offset + 10, },
-        { "$skip": offset },
-        { "$sort": {"name": 1}},
-    ])
-    result_count = containers.count_documents(
-        {
-            "owner": request.user["sub"],
-            "name": query,
-        }
-    )    
+    query_result = next(containers.aggregate(
+        get_search_pipeline({"owner": request.user["sub"]}, data["query"], offset)
+    ))
+    result_count = query_result["total"][0]["count"] if query_result["total"] else 0
 
     results = [
         {
@@ -469,12 +403,11 @@ def search_containers():
             "public": container["public"],
             "size": container["size"],
         }
-        for container in query_result
+        for container in query_result["results"]
     ]
 
     return jsonify({
         "containers": results,
         "total": result_count,
         "hasMore": result_count > offset + 10
-    }), 200
-    
\ No newline at end of file
+    }), 200
\ No newline at end of file
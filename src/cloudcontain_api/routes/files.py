@@ -1,19 +1,28 @@
 import re
+import secrets
 from datetime import datetime, timezone
 
 from bson import ObjectId
 from flask import Blueprint, Response, jsonify, request, stream_with_context
 from flask import current_app as app
 
-from cloudcontain_api.utils.auth import require_auth
+from cloudcontain_api.utils.auth import require_auth, require_container_access
 from cloudcontain_api.utils.constants import (
+    FILE_BATCH_MAX_FILES,
     S3_BUCKET_NAME,
 )
+from cloudcontain_api.utils.indexes import NAME_COLLATION
 from cloudcontain_api.utils.utils import (
+    adjust_container_size,
+    content_cache,
     get_folder_id,
     get_key_string,
+    get_name_tokens,
     get_path,
+    get_s3_object,
+    get_search_pipeline,
     rename_s3_object,
+    stream_file_contents,
     stream_s3_object,
 )
 
@@ -22,6 +31,11 @@ files_bp = Blueprint("files", __name__)
 
 @files_bp.route("/containers/<container_id>/folders/<folder_id>/files", methods=["POST"])
 @require_auth
+@require_container_access(
+    owner=True,
+    fields=("folders", "entryPoint"),
+    action="modify this container",
+)
 def create_file(container_id, folder_id):
     data = request.get_json()
     containers = app.db["containers"]
@@ -29,444 +43,455 @@ def create_file(container_id, folder_id):
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
+    container = request.container
+
+    folder_path = get_path(folder_id, container, include_all=False)
+    if folder_path == -1:
+        return jsonify({"message": "Folder not found within this container."}), 404
+    
+    if ("name" not in data or 
+        not data["name"].strip() or
+        not re.match(r"[\w\-.]+\.[\w]+$", data["name"])):
+        return jsonify({"message": "Please provide a valid filename."}), 400
+    
+    if not data["name"].lower().endswith((".java", ".py", ".c", ".h")):
+        return jsonify(
+            {"message": "Can only save Java, Python or C (.c or .h) files."}
+        ), 403
+    
+    name_duplicate_count = files.count_documents(
+        {"containerId": ObjectId(container_id), 
+        "folder": get_folder_id(folder_id), 
+        "name": data["name"]},
+        limit=1,
+        collation=NAME_COLLATION,
+    ) 
+
+    if name_duplicate_count != 0:
+        return jsonify({"message": "File with this name already exists."}), 409
+    
+    s3_key = get_key_string(container_id, folder_path, data["name"])
+    s3_response =  app.s3.Object(S3_BUCKET_NAME, s3_key).put(Body="")
+
+    if s3_response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+        return jsonify({"message": "Error creating file in storage."}), 500
+    
+    insert_response = files.insert_one(
+        {
+            "containerId": ObjectId(container_id),
+            "createdBy": request.user["sub"],
+            "folder": get_folder_id(folder_id),
+            "key": s3_key,
+            "etag": s3_response["ETag"].strip('"'),
+            "size": 0,
+            "name": data["name"].strip(),
+            "nameTokens": get_name_tokens(data["name"]),
+            "created": timestamp,
+            "lastModified": timestamp,
+        }
     )
 
-    if container:
-        folder_path = get_path(folder_id, container, include_all=False)
-        if folder_path == -1:
-            return jsonify({"message": "Folder not found within this container."}), 404
-        
-        if ("name" not in data or 
-            not data["name"].strip() or
-            not re.match(r"[\w\-.]+\.[\w]+$", data["name"])):
-            return jsonify({"message": "Please provide a valid filename."}), 400
-        
-        if not data["name"].lower().endswith((".java", ".py", ".c", ".h")):
-            return jsonify(
-                {"message": "Can only save Java, Python or C (.c or .h) files."}
-            ), 403
-        
-        name_duplicate_count = files.count_documents(
-            {"containerId": ObjectId(container_id), 
-            "folder": get_folder_id(folder_id), 
-            "name": re.compile(f"^{data["name"]}$", re.IGNORECASE)},
-            limit=1,
-        ) 
+    if insert_response.inserted_id:
+        container_updates = {"lastModified": timestamp}
 
-        if name_duplicate_count != 0:
-            return jsonify({"message": "File with this name already exists."}), 409
-        
-        s3_key = get_key_string(container_id, folder_path, data["name"])
-        s3_response =  app.s3.Object(S3_BUCKET_NAME, s3_key).put(Body="")
+        is_entry = False
+        if container["entryPoint"] is None:
+            container_updates["entryPoint"] = insert_response.inserted_id
+            is_entry = True
 
-        if s3_response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return jsonify({"message": "Error creating file in storage."}), 500
-        
-        insert_response = files.insert_one(
-            {
-                "containerId": ObjectId(container_id),
-                "createdBy": request.user["sub"],
-                "folder": get_folder_id(folder_id),
-                "key": s3_key,
-                "size": 0,
-                "name": data["name"].strip(),
-                "created": timestamp,
-                "lastModified": timestamp,
-            }
+        containers.update_one(
+            {"_id": ObjectId(container_id)}, {"$set": container_updates}
         )
 
-        if insert_response.inserted_id:
-            containers.update_one(
-                {"_id": ObjectId(container_id)}, {"$set": {"lastModified": timestamp}}
-            )
-
-            is_entry = False
-            if container["entryPoint"] is None:
-                containers.update_one(
-                    {"_id": ObjectId(container_id)},
-                    {"$set": {"entryPoint": insert_response.inserted_id}},
-                )
-                is_entry = True
-
-            return jsonify(
-                {"fileId": str(insert_response.inserted_id), "isEntry": is_entry}
-            ), 201
-        
-        else:
-            return jsonify({"message": "Error creating file."}), 500
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
         return jsonify(
-            {"message": "User is not authorized to modify this container."}
-        ), 401
+            {"fileId": str(insert_response.inserted_id), "isEntry": is_entry}
+        ), 201
+    
     else:
-        return jsonify({"message": "Container not found."}), 404
+        return jsonify({"message": "Error creating file."}), 500
 
 
 @files_bp.route("/containers/<container_id>/files/<file_id>", methods=["GET"])
 @require_auth
+@require_container_access(fields=("folders",), action="access this container's files")
 def get_file(container_id, file_id):
-    containers = app.db["containers"]
     files = app.db["files"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-        file = files.find_one(
-            {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
-        )
+    container = request.container
 
-        if file:
-            return jsonify(
-                {
-                    "fileId": str(file["_id"]),
-                    "containerId": str(file["containerId"]),
-                    "createdBy": file["createdBy"],
-                    "folderId": str(file["folder"]),
-                    "key": file["key"],
-                    "size": file["size"],
-                    "path": get_path(str(file["folder"]), container),
-                    "name": file["name"],
-                    "created": str(file["created"]),
-                    "lastModified": str(file["lastModified"]),
-                }
-            ), 200
-        
-        else:
-            return jsonify({"message": "File not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
+    file = files.find_one(
+        {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
+    )
+
+    if file:
         return jsonify(
-            {"message": "User is not authorized to access this container's files."}
-        ), 401
+            {
+                "fileId": str(file["_id"]),
+                "containerId": str(file["containerId"]),
+                "createdBy": file["createdBy"],
+                "folderId": str(file["folder"]),
+                "key": file["key"],
+                "size": file["size"],
+                "path": get_path(str(file["folder"]), container),
+                "name": file["name"],
+                "created": str(file["created"]),
+                "lastModified": str(file["lastModified"]),
+            }
+        ), 200
+    
     else:
-        return jsonify({"message": "Container not found."}), 404
-        
+        return jsonify({"message": "File not found within this container."}), 404
+
 
 @files_bp.route("/containers/<container_id>/files/<file_id>/content", methods=["GET"])
 @require_auth
+@require_container_access(action="access this container's files")
 def get_file_content(container_id, file_id):
-    containers = app.db["containers"]
     files = app.db["files"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-        file = files.find_one(
-            {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
-        )
+    file = files.find_one(
+        {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)},
+        {"key": 1, "etag": 1, "size": 1, "lastModified": 1},
+    )
 
-        if file:
+    if not file:
+        return jsonify({"message": "File not found within this container."}), 404
+
+    # Answered from the stored ETag without touching S3
+    etag = file.get("etag")
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    byte_range = None
+    if request.range and len(request.range.ranges) == 1 and (
+        not request.if_range.etag or request.if_range.etag == etag
+    ):
+        byte_range = request.range.range_for_length(file["size"])
+        if byte_range is None:
             return Response(
-                stream_with_context(stream_s3_object(file["key"])), 
-                content_type="application/octet-stream"
-            ), 200
-        
+                status=416, headers={"Content-Range": f"bytes */{file['size']}"}
+            )
+
+    content = content_cache.get(file["key"], etag) if etag else None
+    if content is not None:
+        body = content[byte_range[0]:byte_range[1]] if byte_range else content
+        content_length = len(body)
+        content_range = None
+        if byte_range:
+            content_range = f"bytes {byte_range[0]}-{byte_range[1] - 1}/{len(content)}"
+
+    else:
+        # Files saved before ETags were stored fall back to a conditional GET
+        if_none_match = None
+        if not etag and request.if_none_match:
+            if_none_match = request.headers.get("If-None-Match")
+
+        try:
+            s3_response = get_s3_object(file["key"], byte_range, if_none_match)
+        except Exception as e:
+            return jsonify({"message": f"Error reading file content from S3. {e}"}), 500
+
+        if s3_response is None:
+            return Response(status=304)
+
+        if not etag:
+            files.update_one(
+                {"_id": file["_id"], "etag": {"$exists": False}},
+                {"$set": {"etag": s3_response["ETag"].strip('"')}},
+            )
+        # The object may have been saved again since the file was read
+        etag = s3_response["ETag"].strip('"')
+
+        content_length = s3_response["ContentLength"]
+        content_range = s3_response.get("ContentRange") if byte_range else None
+        if not byte_range and content_length <= content_cache.max_entry_bytes:
+            with s3_response["Body"] as stream:
+                body = stream.read()
+            content_cache.set(file["key"], etag, body)
         else:
-            return jsonify({"message": "File not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
+            body = stream_with_context(stream_s3_object(s3_response))
+
+    response = Response(
+        body,
+        status=206 if byte_range else 200,
+        content_type="application/octet-stream",
+    )
+    response.set_etag(etag)
+    response.last_modified = file["lastModified"]
+    response.content_length = content_length
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Cache-Control"] = "private, no-cache"
+    if content_range:
+        response.headers["Content-Range"] = content_range
+    return response
+
+
+@files_bp.route("/containers/<container_id>/files/content", methods=["POST"])
+@require_auth
+@require_container_access(action="access this container's files")
+def get_files_content(container_id):
+    data = request.get_json()
+    files = app.db["files"]
+
+    file_ids = data.get("fileIds") if data else None
+    if (not isinstance(file_ids, list) or not file_ids
+            or not all(isinstance(file_id, str) and ObjectId.is_valid(file_id) for file_id in file_ids)):
+        return jsonify({"message": "Please provide a list of valid file IDs."}), 400
+
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) > FILE_BATCH_MAX_FILES:
         return jsonify(
-            {"message": "User is not authorized to access this container's files."}
-        ), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
+            {"message": f"Cannot fetch more than {FILE_BATCH_MAX_FILES} files at once."}
+        ), 400
+
+    found_files = {
+        str(file["_id"]): file
+        for file in files.find(
+            {
+                "_id": {"$in": [ObjectId(file_id) for file_id in file_ids]},
+                "containerId": ObjectId(container_id),
+            },
+            {"key": 1, "etag": 1},
+        )
+    }
+
+    boundary = secrets.token_hex(16)
+    return Response(
+        stream_with_context(stream_file_contents(
+            app.s3.meta.client, file_ids, found_files, boundary
+        )),
+        content_type=f"multipart/mixed; boundary={boundary}",
+    )
 
 
 @files_bp.route("/containers/<container_id>/files/<file_id>", methods=["PUT"])
 @require_auth
+@require_container_access(owner=True, fields=("folders",), action="modify this container's files")
 def update_file(container_id, file_id):
     data = request.get_json()
-    containers = app.db["containers"]
     files = app.db["files"]
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
+    container = request.container
+
+    file = files.find_one(
+        {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
     )
 
-    if container:
-        file = files.find_one(
-            {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
+    if file:
+        new_name = data.get("name", file["name"]).strip()
+
+        name_duplicate_count = files.count_documents(
+            {"containerId": ObjectId(container_id), 
+             "folder": get_folder_id(data.get("folder", file["folder"])), 
+             "name": new_name,
+             "_id": {"$ne": ObjectId(file_id)}},
+            limit=1,
+            collation=NAME_COLLATION,
         )
 
-        if file:
-            new_name = data.get("name", file["name"]).strip()
+        if name_duplicate_count != 0:
+            return jsonify({"message": "File with this name already exists."}), 409
+
+        updates = dict()
+
+        if "name" in data and data["name"]:
+            data["name"] = data["name"].strip()
+
+            if not re.match(r"[\w\-.]+\.[\w]+$", data["name"]):
+                return jsonify({"message": "Please provide a valid filename."}), 400
+            
+            if not data["name"].lower().endswith((".java", ".py", ".c", ".h")):
+                return jsonify(
+                    {"message": "Can only save Java, Python or C (.c or .h) files."}
+                ), 403
+            
+            updates["name"] = data["name"]
+            updates["nameTokens"] = get_name_tokens(data["name"])
 
-            name_duplicate_count = files.count_documents(
-                {"containerId": ObjectId(container_id), 
-                 "folder": get_folder_id(data.get("folder", file["folder"])), 
-                 "name": re.compile(f"^{new_name}$", re.IGNORECASE),
-                 "_id": {"$ne": ObjectId(file_id)}},
-                limit=1,
+        if "folder" in data and data["folder"]:
+            folder_path = get_path(data["folder"], container, include_all=False)
+            if folder_path == -1:
+                return jsonify({"message": "Folder not found within this container."}), 404
+
+            updates["folder"] = get_folder_id(data["folder"])
+
+        if updates:
+            new_folder = data.get("folder", str(file["folder"]))
+            new_path = get_path(new_folder, container, include_all=False)
+            new_key = get_key_string(container_id, new_path, new_name)
+
+            updates["key"] = new_key    
+            rename_s3_object(file["key"], new_key)
+
+            files.update_one(
+                {"_id": ObjectId(file_id)},
+                {
+                    "$set": {
+                        "lastModified": timestamp,
+                        **updates
+                    }
+                },
             )
 
-            if name_duplicate_count != 0:
-                return jsonify({"message": "File with this name already exists."}), 409
-
-            updates = dict()
-
-            if "name" in data and data["name"]:
-                data["name"] = data["name"].strip()
-
-                if not re.match(r"[\w\-.]+\.[\w]+$", data["name"]):
-                    return jsonify({"message": "Please provide a valid filename."}), 400
-                
-                if not data["name"].lower().endswith((".java", ".py", ".c", ".h")):
-                    return jsonify(
-                        {"message": "Can only save Java, Python or C (.c or .h) files."}
-                    ), 403
-                
-                updates["name"] = data["name"]
-
-            if "folder" in data and data["folder"]:
-                folder_path = get_path(data["folder"], container, include_all=False)
-                if folder_path == -1:
-                    return jsonify({"message": "Folder not found within this container."}), 404
-
-                updates["folder"] = get_folder_id(data["folder"])
-
-            if updates:
-                new_folder = data.get("folder", file["folder"])
-                new_path = get_path(new_folder, container, include_all=False)
-                new_key = get_key_string(container_id, new_path, new_name)
-
-                updates["key"] = new_key    
-                rename_s3_object(file["key"], new_key)
-
-                files.update_one(
-                    {"_id": ObjectId(file_id)},
-                    {
-                        "$set": {
-                            "lastModified": timestamp,
-                            **updates
-                        }
-                    },
-                )
-
-                return jsonify({
-                    "fileId": str(file["_id"]),
-                    "folderId": new_folder,
-                    "key": new_key,
-                    "name": new_name,
-                    "path": get_path(new_folder, container),
-                    "lastModified": str(timestamp)
-                }), 200
-
-            else:
-                return jsonify({"message": "No valid updates provided."}), 400
+            return jsonify({
+                "fileId": str(file["_id"]),
+                "folderId": new_folder,
+                "key": new_key,
+                "name": new_name,
+                "path": get_path(new_folder, container),
+                "lastModified": str(timestamp)
+            }), 200
+
         else:
-            return jsonify({"message": "File not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify(
-            {"message": "User is not authorized to modify this container's files."}
-        ), 401
+            return jsonify({"message": "No valid updates provided."}), 400
     else:
-        return jsonify({"message": "Container not found."}), 404
-    
+        return jsonify({"message": "File not found within this container."}), 404
+
 
 @files_bp.route("/containers/<container_id>/files/<file_id>/content", methods=["PUT"])
 @require_auth
+@require_container_access(owner=True, action="modify this container's files")
 def update_file_content(container_id, file_id):
-    containers = app.db["containers"]
     files = app.db["files"]
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
+    file = files.find_one(
+        {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
     )
 
-    if container:
-        file = files.find_one(
-            {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
-        )
-
-        if file:
-            file_size = request.content_length
-            if file_size and file_size > 100 * 1024:
-                return jsonify({"message": "File size exceeds the 100KB limit."}), 413
-            
-            delta = file_size - file["size"]
-            if container["size"] + delta > 5 * 1024 * 1024:
-                return jsonify({"message": "Container size limit of 5MB exceeded."}), 413
-
-            try:
-                s3_object = app.s3.Object(S3_BUCKET_NAME, file["key"])
-                s3_object.upload_fileobj(request.stream)
-            except Exception as e:
-                return jsonify({"message": f"Error updating file content in S3. {e}"}), 500
-            
-            files.update_one(
-                {"_id": ObjectId(file_id)}, {"$set": 
-                    {
-                        "lastModified": timestamp,
-                        "size": file_size,
-                    }
-                }
-            )
-
-            containers.update_one(
-                {"_id": ObjectId(container_id)}, {"$set": 
-                    {
-                        "lastModified": timestamp,
-                        "size": container["size"] + delta,
-                    }
-                }
-            )
-
-            return jsonify(
+    if file:
+        file_size = request.content_length
+        if file_size and file_size > 100 * 1024:
+            return jsonify({"message": "File size exceeds the 100KB limit."}), 413
+        
+        delta = file_size - file["size"]
+        if not adjust_container_size(container_id, delta, timestamp):
+            return jsonify({"message": "Container size limit of 5MB exceeded."}), 413
+
+        try:
+            content = request.stream.read()
+            s3_object = app.s3.Object(S3_BUCKET_NAME, file["key"])
+            s3_response = s3_object.put(Body=content)
+        except Exception as e:
+            adjust_container_size(container_id, -delta, timestamp, enforce_limit=False)
+            return jsonify({"message": f"Error updating file content in S3. {e}"}), 500
+        content_cache.set(file["key"], s3_response["ETag"].strip('"'), content)
+        
+        previous = files.find_one_and_update(
+            {"_id": ObjectId(file_id)}, {"$set": 
                 {
-                    "fileId": str(file["_id"]),
-                    "lastModified": str(timestamp),
+                    "lastModified": timestamp,
+                    "etag": s3_response["ETag"].strip('"'),
                     "size": file_size,
-                    "delta": delta,
                 }
-            ), 200
+            },
+            projection={"size": 1},
+        )
+
+        # Another save replaced the file since it was read, so the delta was taken
+        # against a stale size
+        if previous and previous["size"] != file["size"]:
+            adjust_container_size(
+                container_id, file["size"] - previous["size"], timestamp, enforce_limit=False
+            )
 
-        else:
-            return jsonify({"message": "File not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
         return jsonify(
-            {"message": "User is not authorized to modify this container's files."}
-        ), 401
+            {
+                "fileId": str(file["_id"]),
+                "lastModified": str(timestamp),
+                "size": file_size,
+                "delta": delta,
+            }
+        ), 200
+
     else:
-        return jsonify({"message": "Container not found."}), 404
+        return jsonify({"message": "File not found within this container."}), 404
 
 
 @files_bp.route("/containers/<container_id>/files/<file_id>", methods=["DELETE"])
 @require_auth
+@require_container_access(
+    owner=True,
+    fields=("entryPoint",),
+    action="delete this container's files",
+)
 def delete_file(container_id, file_id):
-    containers = app.db["containers"]
     files = app.db["files"]
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
-    )
+    container = request.container
 
-    if container:
-        if str(container["entryPoint"]) == file_id:
-            return jsonify({
-                "message": (
-                    "Cannot delete the Entry Point of this container. "
-                    "Set a different file as the Entry Point before re-attempting."
-                )
-            }), 409
-        
-        file = files.find_one(
-            {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
-        )
-
-        if file:
-            try:
-                s3_object = app.s3.Object(S3_BUCKET_NAME, file["key"])
-                response = s3_object.delete()
-                if response["ResponseMetadata"]["HTTPStatusCode"] != 204:
-                    return jsonify({"message": "Error deleting file from S3."}), 500
-            except Exception as e:
-                return jsonify({"message": f"Error deleting file from S3. {e}"}), 500
-            
-            files.delete_one({"_id": ObjectId(file_id)})
-
-            containers.update_one(
-                {"_id": ObjectId(container_id)}, {
-                    "$set": {
-                        "lastModified": timestamp,
-                        "size": container["size"] - file["size"],
-                    }
-                }
+    if str(container["entryPoint"]) == file_id:
+        return jsonify({
+            "message": (
+                "Cannot delete the Entry Point of this container. "
+                "Set a different file as the Entry Point before re-attempting."
             )
+        }), 409
+    
+    file = files.find_one(
+        {"_id": ObjectId(file_id), "containerId": ObjectId(container_id)}
+    )
 
-            return '', 204
+    if file:
+        try:
+            s3_object = app.s3.Object(S3_BUCKET_NAME, file["key"])
+            response = s3_object.delete()
+            if response["ResponseMetadata"]["HTTPStatusCode"] != 204:
+                return jsonify({"message": "Error deleting file from S3."}), 500
+        except Exception as e:
+            return jsonify({"message": f"Error deleting file from S3. {e}"}), 500
+        content_cache.pop(file["key"])
         
-        else:
-            return jsonify({"message": "File not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify(
-            {"message": "User is not authorized to delete this container's files."}
-        ), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
+        deleted = files.find_one_and_delete({"_id": ObjectId(file_id)}, projection={"size": 1})
+        if deleted:
+            adjust_container_size(container_id, -deleted["size"], timestamp)
+
+        return '', 204
     
+    else:
+        return jsonify({"message": "File not found within this container."}), 404
+
 
 @files_bp.route("/containers/<container_id>/files/search", methods=["POST"])
 @require_auth
+@require_container_access(action="search this container's files")
 def search_files(container_id):
     data = request.get_json()
     offset = int(request.args.get("offset", 0))
-    containers = app.db["containers"]
     files = app.db["files"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-
-        if "query" not in data or not data["query"].strip():
-            return jsonify({"message": "Please provide a valid search query."}), 400
-        
-        query = re.compile(re.escape(data["query"]), re.IGNORECASE)
-        query_result = files.aggregate([
-            {
-                "$match": {
-                    "containerId": ObjectId(container_id),
-                    "name": query,
-                }
-            },
-            { "$limit": offset + 10, },
-            { "$skip": offset },
-            { "$sort": {"name": 1}},
-        ])
-        result_count = files.count_documents(
-            {
-                "containerId": ObjectId(container_id),
-                "name": query,
-            }
-        )    
-
-        results = [
-            {
-                "fileId": str(file["_id"]),
-                "containerId": str(file["containerId"]),
-                "createdBy": file["createdBy"],
-                "folder": str(file["folder"]),
-                "size": file["size"],
-                "key": file["key"],
-                "name": file["name"],
-                "created": str(file["created"]),
-                "lastModified": str(file["lastModified"]),
-            }
-            for file in query_result
-        ]
-
-        return jsonify({
-            "files": results,
-            "total": result_count,
-            "hasMore": result_count > offset + 10
-        }), 200
+    if "query" not in data or not data["query"].strip():
+        return jsonify({"message": "Please provide a valid search query."}), 400
     
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify(
-            {"message": "User is not authorized to search this container's files."}
-        ), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
\ No newline at end of file
+    query_result = next(files.aggregate(
+        get_search_pipeline({"containerId": ObjectId(container_id)}, data["query"], offset)
+    ))
+    result_count = query_result["total"][0]["count"] if query_result["total"] else 0
+
+    results = [
+        {
+            "fileId": str(file["_id"]),
+            "containerId": str(file["containerId"]),
+            "createdBy": file["createdBy"],
+            "folder": str(file["folder"]),
+            "size": file["size"],
+            "key": file["key"],
+            "name": file["name"],
+            "created": str(file["created"]),
+            "lastModified": str(file["lastModified"]),
+        }
+        for file in query_result["results"]
+    ]
+
+    return jsonify({
+        "files": results,
+        "total": result_count,
+        "hasMore": result_count > offset + 10
+    }), 200
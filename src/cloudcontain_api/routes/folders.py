@@ -1,21 +1,31 @@
 import re
+import tarfile
+import zipfile
 from datetime import datetime, timezone
 
 from bson import ObjectId
 from flask import Blueprint, jsonify, request
 from flask import current_app as app
+from pymongo import UpdateOne
 
-from cloudcontain_api.utils.auth import require_auth
-from cloudcontain_api.utils.constants import (
-    S3_BUCKET_NAME,
-)
+from cloudcontain_api.utils.archive import ARCHIVE_FORMATS, ArchiveTooLarge, iter_archive
+from cloudcontain_api.utils.auth import require_auth, require_container_access
+from cloudcontain_api.utils.constants import CONTAINER_SIZE_LIMIT
+from cloudcontain_api.utils.indexes import NAME_COLLATION
 from cloudcontain_api.utils.utils import (
-    get_all_keys,
-    get_container_contents,
+    adjust_container_size,
+    content_cache,
+    copy_s3_objects,
+    delete_s3_objects,
     get_folder_id,
+    get_folder_sizes,
     get_key_string,
+    get_name_tokens,
     get_path,
-    rename_s3_object,
+    get_subtree,
+    put_s3_objects,
+    run_in_transaction,
+    update_folder_paths,
 )
 
 folders_bp = Blueprint("folders", __name__)
@@ -23,6 +33,7 @@ folders_bp = Blueprint("folders", __name__)
 
 @folders_bp.route("/containers/<container_id>/folders/<folder_id>", methods=["POST"])
 @require_auth
+@require_container_access(owner=True, fields=("folders",), action="modify this container")
 def create_folder(container_id, folder_id):
     data = request.get_json()
     containers = app.db["containers"]
@@ -30,34 +41,34 @@ def create_folder(container_id, folder_id):
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
-    )
+    container = request.container
 
-    if container:
-        if get_path(folder_id, container, include_all=False) == -1:
-            return jsonify(
-                {"message": "Parent folder not found within this container."}
-            ), 404
-        
-        if "name" not in data or not re.match(r"[\w\-.]+$", data["name"]):
-            return jsonify(
-                {"message": "Please provide a valid folder name."}
-            ), 400
-        
-        name_duplicate_count = folders.count_documents(
-            {
-                "containerId": ObjectId(container_id),
-                "parent": get_folder_id(folder_id),
-                "name": re.compile(f"^{data["name"]}$", re.IGNORECASE),
-            },
-            limit=1,
-        )
-        if name_duplicate_count != 0:
-            return jsonify(
-                {"message": "A folder with this name already exists in this location."}
-            ), 409
-        
+    parent_path = get_path(folder_id, container)
+    if parent_path == -1:
+        return jsonify(
+            {"message": "Parent folder not found within this container."}
+        ), 404
+    
+    if "name" not in data or not re.match(r"[\w\-.]+$", data["name"]):
+        return jsonify(
+            {"message": "Please provide a valid folder name."}
+        ), 400
+    
+    name_duplicate_count = folders.count_documents(
+        {
+            "containerId": ObjectId(container_id),
+            "parent": get_folder_id(folder_id),
+            "name": data["name"],
+        },
+        limit=1,
+        collation=NAME_COLLATION,
+    )
+    if name_duplicate_count != 0:
+        return jsonify(
+            {"message": "A folder with this name already exists in this location."}
+        ), 409
+    
+    def write_folder(session):
         insert_response = folders.insert_one(
             {
                 "containerId": ObjectId(container_id),
@@ -66,146 +77,133 @@ def create_folder(container_id, folder_id):
                 "name": data["name"].strip(),
                 "created": timestamp,
                 "lastModified": timestamp,
-            }
+            },
+            session=session,
         )
 
-        if insert_response.inserted_id:
-            created_folder_id = str(insert_response.inserted_id)
-            containers.update_one(
-                {"_id": ObjectId(container_id)},
-                {
-                    "$set": {
-                        f"folders.{created_folder_id}": {
-                            "folderId": created_folder_id,
-                            "parent": folder_id,
-                            "name": data["name"].strip(),
-                        },
-                        "lastModified": timestamp,
-                    }
-                },
-            )
-            return jsonify({"folderId": created_folder_id}), 201
-        
-        else:
-            return jsonify({"message": "Error creating folder."}), 500
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to modify this container."
-        }), 401
+        if not insert_response.inserted_id:
+            return None
+
+        created_folder_id = str(insert_response.inserted_id)
+        containers.update_one(
+            {"_id": ObjectId(container_id)},
+            {
+                "$set": {
+                    f"folders.{created_folder_id}": {
+                        "folderId": created_folder_id,
+                        "parent": folder_id,
+                        "name": data["name"].strip(),
+                        "path": parent_path + [
+                            {"folderId": created_folder_id, "name": data["name"].strip()}
+                        ],
+                    },
+                    "lastModified": timestamp,
+                }
+            },
+            session=session,
+        )
+        return created_folder_id
+
+    created_folder_id = run_in_transaction(write_folder)
+    if created_folder_id:
+        return jsonify({"folderId": created_folder_id}), 201
+    
     else:
-        return jsonify({"message": "Container not found."}), 404
-        
+        return jsonify({"message": "Error creating folder."}), 500
+
 
 @folders_bp.route("/containers/<container_id>/folders/<folder_id>", methods=["GET"])
 @require_auth
+@require_container_access(fields=("folders", "created"), action="access this container's folders")
 def get_folder(container_id, folder_id):
-    containers = app.db["containers"]
     folders = app.db["folders"]
     files = app.db["files"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-        folder_path = get_path(folder_id, container)
-        if folder_path == -1:
-            return jsonify(
-                {"message": "Folder not found within this container."}
-            ), 404
-        
-        sub_directories_response = folders.find(
-            {
-                "containerId": ObjectId(container_id),
-                "parent": get_folder_id(folder_id),
-            }
-        )
+    container = request.container
 
-        sub_directories = [
-            {
-                "folderId": str(directory["_id"]),
-                "containerId": str(directory["containerId"]),
-                "parent": str(directory["parent"]),
-                "name": directory["name"],
-                "created": str(directory["created"]),
-                "lastModified": str(directory["lastModified"]),
-            }
-            for directory in sub_directories_response
-        ]
-
-        for dir in sub_directories:
-            directory_path = get_path(dir["folderId"], container, include_all=False)
-            prefix = get_key_string(container_id, directory_path)
-            directory_size = sum(
-                obj.size for
-                obj in app.s3.Bucket(S3_BUCKET_NAME).objects.filter(Prefix=prefix)
-            )
-            dir["size"] = directory_size
+    folder_path = get_path(folder_id, container)
+    if folder_path == -1:
+        return jsonify(
+            {"message": "Folder not found within this container."}
+        ), 404
+    
+    sub_directories_response = folders.find(
+        {
+            "containerId": ObjectId(container_id),
+            "parent": get_folder_id(folder_id),
+        }
+    )
 
-        sub_files_response = files.find(
+    sub_directories = [
+        {
+            "folderId": str(directory["_id"]),
+            "containerId": str(directory["containerId"]),
+            "parent": str(directory["parent"]),
+            "name": directory["name"],
+            "created": str(directory["created"]),
+            "lastModified": str(directory["lastModified"]),
+        }
+        for directory in sub_directories_response
+    ]
+
+    folder_sizes = get_folder_sizes(container, files)
+    for dir in sub_directories:
+        dir["size"] = folder_sizes.get(dir["folderId"], 0)
+
+    sub_files_response = files.find(
+        {
+            "containerId": ObjectId(container_id),
+            "folder": get_folder_id(folder_id),
+        }
+    )
+
+    sub_files = [
+        {
+            "fileId": str(file["_id"]),
+            "containerId": str(file["containerId"]),
+            "createdBy": file["createdBy"],
+            "folder": str(file["folder"]),
+            "size": file["size"],
+            "key": file["key"],
+            "name": file["name"],
+            "created": str(file["created"]),
+            "lastModified": str(file["lastModified"]),
+        }
+        for file in sub_files_response
+    ]
+
+    total_file_size = sum(file["size"] for file in sub_files)
+    total_directory_size = sum(dir["size"] for dir in sub_directories)
+    total_size = total_file_size + total_directory_size
+
+    metadata = None
+    # Only fetch metadata if not root folder
+    if folder_id != "~":
+        metadata = folders.find_one(
             {
+                "_id": ObjectId(folder_id),
                 "containerId": ObjectId(container_id),
-                "folder": get_folder_id(folder_id),
             }
         )
 
-        sub_files = [
-            {
-                "fileId": str(file["_id"]),
-                "containerId": str(file["containerId"]),
-                "createdBy": file["createdBy"],
-                "folder": str(file["folder"]),
-                "size": file["size"],
-                "key": file["key"],
-                "name": file["name"],
-                "created": str(file["created"]),
-                "lastModified": str(file["lastModified"]),
-            }
-            for file in sub_files_response
-        ]
-
-        total_file_size = sum(file["size"] for file in sub_files)
-        total_directory_size = sum(dir["size"] for dir in sub_directories)
-        total_size = total_file_size + total_directory_size
-
-        metadata = None
-        # Only fetch metadata if not root folder
-        if folder_id != "~":
-            metadata = folders.find_one(
-                {
-                    "_id": ObjectId(folder_id),
-                    "containerId": ObjectId(container_id),
-                }
-            )
+    return jsonify(
+        {
+            "folderId": folder_id,
+            "name": metadata["name"] if (metadata and folder_id != "~") else "ROOT",
+            "parent": str(metadata["parent"]) if metadata else None,
+            "path": folder_path,
+            "directories": sub_directories,
+            "files": sub_files,
+            "size": total_size,
+            "created": str(metadata["created"]) if metadata else str(container["created"]),
+            "lastModified": str(metadata["lastModified"]) if metadata else None,
+        }
+    ), 200
 
-        return jsonify(
-            {
-                "folderId": folder_id,
-                "name": metadata["name"] if (metadata and folder_id != "~") else "ROOT",
-                "parent": str(metadata["parent"]) if metadata else None,
-                "path": folder_path,
-                "directories": sub_directories,
-                "files": sub_files,
-                "size": total_size,
-                "created": str(metadata["created"]) if metadata else str(container["created"]),
-                "lastModified": str(metadata["lastModified"]) if metadata else None,
-            }
-        ), 200
-    
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to access this container's folders."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
-        
 
 @folders_bp.route("/containers/<container_id>/folders/<folder_id>", methods=["PUT"])
 @require_auth
+@require_container_access(owner=True, fields=("folders",), action="modify this container's folders")
 def update_folder(container_id, folder_id):
     data = request.get_json()
     containers = app.db["containers"]
@@ -214,120 +212,149 @@ def update_folder(container_id, folder_id):
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
+    container = request.container
+
+    if folder_id == "~":
+        return jsonify({"message": "Cannot modify root folder."}), 403
+    
+    folder = folders.find_one(
+        {"_id": ObjectId(folder_id), "containerId": ObjectId(container_id)}
     )
+    
+    if folder:
+        new_name = data.get("name", folder["name"]).strip()
+        new_parent = get_folder_id(data.get("parent", folder["parent"]))
 
-    if container:
-        if folder_id == "~":
-            return jsonify({"message": "Cannot modify root folder."}), 403
-        
-        folder = folders.find_one(
-            {"_id": ObjectId(folder_id), "containerId": ObjectId(container_id)}
+        name_duplicate_count = folders.count_documents(
+            {
+                "containerId": ObjectId(container_id),
+                "parent": new_parent,
+                "name": new_name,
+                "_id": {"$ne": ObjectId(folder_id)},
+            },
+            limit=1,
+            collation=NAME_COLLATION,
         )
-        
-        if folder:
-            new_name = data.get("name", folder["name"]).strip()
-            new_parent = get_folder_id(data.get("parent", folder["parent"]))
-
-            name_duplicate_count = folders.count_documents(
-                {
-                    "containerId": ObjectId(container_id),
-                    "parent": new_parent,
-                    "name": re.compile(f"^{new_name}$", re.IGNORECASE),
-                    "_id": {"$ne": ObjectId(folder_id)},
-                },
-                limit=1,
-            )
-
-            if name_duplicate_count != 0:
-                return jsonify({"message": "Folder with this name already exists."}), 409
 
-            updates = dict()
-
-            if "name" in data and data["name"]:
-                data["name"] = data["name"].strip()
+        if name_duplicate_count != 0:
+            return jsonify({"message": "Folder with this name already exists."}), 409
+
+        updates = dict()
+
+        if "name" in data and data["name"]:
+            data["name"] = data["name"].strip()
+
+            if not re.match(r"[\w\-.]+$", data["name"]):
+                return jsonify({"message": "Please provide a valid folder name."}), 400
+            
+            container["folders"][folder_id]["name"] = data["name"]
+            updates["name"] = data["name"]
+
+        if "parent" in data and data["parent"]:
+            parent_path = get_path(data["parent"], container)
+            if parent_path == -1:
+                return jsonify({"message": "Parent folder not found within this container."}), 404
+
+            if folder_id in [data["parent"]] + [entry["folderId"] for entry in parent_path]:
+                return jsonify({"message": "Cannot move a folder into itself or one of its subfolders."}), 400
+            
+            container["folders"][folder_id]["parent"] = data["parent"]
+            updates["parent"] = get_folder_id(data["parent"])
+
+        if updates:
+            path_updates = update_folder_paths(folder_id, container["folders"])
+            _, file_keys = get_subtree(folder_id, container, files)
+
+            new_keys = {
+                file["key"]: get_key_string(
+                    container_id,
+                    get_path(file["folder"], container, include_all=False),
+                    file["name"],
+                )
+                for file in file_keys
+            }
+            copied_keys, failed_keys = copy_s3_objects(new_keys.items())
 
-                if not re.match(r"[\w\-.]+$", data["name"]):
-                    return jsonify({"message": "Please provide a valid folder name."}), 400
-                
-                container["folders"][folder_id]["name"] = data["name"]
-                containers.update_one(
-                    {"_id": ObjectId(container_id)},
+            # Paths only move if every file could follow them, so drop the partial copies
+            if failed_keys:
+                delete_s3_objects([new_keys[key] for key in copied_keys])
+                return jsonify({
+                    "message": "Error moving some files in storage. The folder was not changed.",
+                    "failed": [
+                        {"key": key, "error": error}
+                        for key, error in failed_keys.items()
+                    ],
+                }), 500
+
+            def write_updates(session):
+                folders.update_one(
+                    {"_id": ObjectId(folder_id)},
                     {
                         "$set": {
-                            f"folders.{folder_id}.name": data["name"],
                             "lastModified": timestamp,
+                            **updates
                         }
                     },
+                    session=session,
                 )
 
-                updates["name"] = data["name"]
-
-            if "parent" in data and data["parent"]:
-                if get_path(data["parent"], container, include_all=False) == -1:
-                    return jsonify({"message": "Parent folder not found within this container."}), 404
-                
-                container["folders"][folder_id]["parent"] = data["parent"]
+                # Name, parent and the materialized paths of the whole subtree change together
                 containers.update_one(
                     {"_id": ObjectId(container_id)},
                     {
                         "$set": {
-                            f"folders.{folder_id}.parent": data["parent"],
+                            f"folders.{folder_id}.name": container["folders"][folder_id]["name"],
+                            f"folders.{folder_id}.parent": container["folders"][folder_id]["parent"],
+                            **{
+                                f"folders.{updated_id}.path": path
+                                for updated_id, path in path_updates.items()
+                            },
                             "lastModified": timestamp,
                         }
                     },
+                    session=session,
                 )
 
-                updates["parent"] = get_folder_id(data["parent"])
-
-            if updates:
-                folders.update_one(
-                    {"_id": ObjectId(folder_id)},
-                    {
-                        "$set": {
-                            "lastModified": timestamp,
-                            **updates
-                        }
-                    },
-                )
-                                
-                all_files, all_folders = get_container_contents(container_id, files, folders)
-                _, file_keys = get_all_keys(folder_id, all_folders, all_files)
-
-                for file in file_keys:
-                    file_path = get_path(file["folder"], container, include_all=False)
-                    new_key = get_key_string(container_id, file_path, file["name"])
-                    rename_s3_object(file["key"], new_key)
-                    files.update_one(
+                key_updates = [
+                    UpdateOne(
                         {"_id": ObjectId(file["fileId"])},
-                        {
-                            "$set": {
-                                "key": new_key,
-                            }
-                        },
+                        {"$set": {"key": new_keys[file["key"]]}},
                     )
+                    for file in file_keys
+                    if file["key"] in copied_keys
+                ]
+                if key_updates:
+                    files.bulk_write(key_updates, ordered=False, session=session)
+
+            run_in_transaction(write_updates)
+
+            # The move has committed; old objects left behind are only unreferenced copies
+            leftover_keys = delete_s3_objects(list(copied_keys))
+            if leftover_keys:
+                app.logger.warning(
+                    "Could not delete %d old objects after moving folder %s: %s",
+                    len(leftover_keys), folder_id, leftover_keys,
+                )
 
-                return jsonify({
-                    "folderId": folder_id,
-                    "path": get_path(folder_id, container),
-                    "lastModified": str(timestamp),
-                }), 200
+            return jsonify({
+                "folderId": folder_id,
+                "path": get_path(folder_id, container),
+                "lastModified": str(timestamp),
+            }), 200
 
-            else:
-                return jsonify({"message": "No valid updates provided."}), 400
         else:
-            return jsonify({"message": "Folder not found within this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to modify this container's folders."
-        }), 401
+            return jsonify({"message": "No valid updates provided."}), 400
     else:
-        return jsonify({"message": "Container not found."}), 404
-        
-    
+        return jsonify({"message": "Folder not found within this container."}), 404
+
+
 @folders_bp.route("/containers/<container_id>/folders/<folder_id>", methods=["DELETE"])
 @require_auth
+@require_container_access(
+    owner=True,
+    fields=("folders", "entryPoint"),
+    action="delete this container's folders",
+)
 def delete_folder(container_id, folder_id):
     containers = app.db["containers"]
     files = app.db["files"]
@@ -335,87 +362,270 @@ def delete_folder(container_id, folder_id):
 
     timestamp = datetime.now(timezone.utc)
 
-    container = containers.find_one(
-        {"_id": ObjectId(container_id), "owner": request.user["sub"]}
-    )
+    container = request.container
 
-    if container:
-        if folder_id == "~":
-            return jsonify({"message": "Cannot delete root folder."}), 403
-        
-        if get_path(folder_id, container, include_all=False) == -1:
-            return jsonify({"message": "Folder not found within this container."}), 404
-        
-        all_files, all_folders = get_container_contents(container_id, files, folders)
-        folder_keys, file_keys = get_all_keys(folder_id, all_folders, all_files)
-
-        contains_entrypoint = any(file["fileId"] == str(container["entryPoint"]) for file in file_keys)
-        if contains_entrypoint:
-            return jsonify({
-                "message": (
-                    "Cannot delete folder containing the Entry Point of this container. "
-                    "Set a different file as the Entry Point before re-attempting."
-                )
-            }), 409
-
-        delete_keys = [
-            {"Key": file["key"]} 
-            for file in file_keys
-        ]
-        if delete_keys:
-            app.s3.Bucket(S3_BUCKET_NAME).delete_objects(Delete={"Objects": delete_keys})
-
-        folders.delete_many({
-            "_id": {
-                "$in": [ObjectId(folder["folderId"]) for folder in folder_keys]
-            }
-        })
+    if folder_id == "~":
+        return jsonify({"message": "Cannot delete root folder."}), 403
+    
+    if get_path(folder_id, container, include_all=False) == -1:
+        return jsonify({"message": "Folder not found within this container."}), 404
+    
+    folder_ids, file_keys = get_subtree(folder_id, container, files)
 
-        total_size_response = next(files.aggregate([
-            {
-                "$match": {
-                    "_id": {
-                        "$in": [ObjectId(file["fileId"]) for file in file_keys]
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": None,
-                    "totalSize": {"$sum": "$size"}
-                }
-            }
-        ]), {"totalSize": 0})
-        total_size = total_size_response["totalSize"]
+    contains_entrypoint = any(file["fileId"] == str(container["entryPoint"]) for file in file_keys)
+    if contains_entrypoint:
+        return jsonify({
+            "message": (
+                "Cannot delete folder containing the Entry Point of this container. "
+                "Set a different file as the Entry Point before re-attempting."
+            )
+        }), 409
 
-        files.delete_many({
-            "_id": {
-                "$in": [ObjectId(file["fileId"]) for file in file_keys]
-            }
-        }) 
+    failed_keys = delete_s3_objects([file["key"] for file in file_keys])
 
-        containers.update_one(
-            {"_id": ObjectId(container_id)}, 
-            {
-                "$set": { 
-                    "lastModified": timestamp,
-                    "size": container["size"] - total_size
-                },
-                "$unset": {
-                    f"folders.{folder['folderId']}": "" for folder in folder_keys
-                },
-            },
+    # Files whose objects could not be deleted keep their rows, and so does the folder tree
+    deleted_files = [file for file in file_keys if file["key"] not in failed_keys]
+    total_size = sum(file["size"] for file in deleted_files)
+
+    def write_deletes(session):
+        if not failed_keys:
+            folders.delete_many(
+                {"_id": {"$in": [ObjectId(subfolder_id) for subfolder_id in folder_ids]}},
+                session=session,
+            )
+        files.delete_many(
+            {"_id": {"$in": [ObjectId(file["fileId"]) for file in deleted_files]}},
+            session=session,
         )
+        update = {
+            "$set": {"lastModified": timestamp},
+            "$inc": {"size": -total_size},
+        }
+        if not failed_keys:
+            update["$unset"] = {f"folders.{subfolder_id}": "" for subfolder_id in folder_ids}
+        containers.update_one({"_id": ObjectId(container_id)}, update, session=session)
 
-        return jsonify(
-            {
-                "delta": total_size,
-            }
-        ), 200
-    
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
+    run_in_transaction(write_deletes)
+
+    if failed_keys:
         return jsonify({
-            "message": "User is not authorized to delete this container's folders."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
\ No newline at end of file
+            "message": "Error deleting some files in storage. The folder was not deleted.",
+            "delta": total_size,
+            "failed": [
+                {"key": key, "error": error}
+                for key, error in failed_keys.items()
+            ],
+        }), 500
+
+    return jsonify(
+        {
+            "delta": total_size,
+        }
+    ), 200
+
+
+@folders_bp.route("/containers/<container_id>/folders/<folder_id>/archive", methods=["POST"])
+@require_auth
+@require_container_access(
+    owner=True,
+    fields=("folders", "entryPoint", "size"),
+    action="modify this container",
+)
+def upload_folder_archive(container_id, folder_id):
+    containers = app.db["containers"]
+    folders = app.db["folders"]
+    files = app.db["files"]
+    archive_format = request.args.get("format", "zip")
+
+    timestamp = datetime.now(timezone.utc)
+
+    container = request.container
+
+    base_path = get_path(folder_id, container)
+    if base_path == -1:
+        return jsonify({"message": "Folder not found within this container."}), 404
+
+    if archive_format not in ARCHIVE_FORMATS:
+        return jsonify({"message": "Archive format must be zip or tar.gz."}), 400
+
+    # Archive folders are merged into existing folders of the same name
+    children = {
+        (cur_folder["parent"], cur_folder["name"].lower()): cur_id
+        for cur_id, cur_folder in container["folders"].items()
+    }
+    paths = {folder_id: base_path}
+    new_folders = {}
+    new_files = []
+    seen_files = set()
+    total_size = 0
+
+    def resolve_folder(names):
+        cur_id = folder_id
+        for name in names:
+            parent_id = cur_id
+            cur_id = children.get((parent_id, name.lower()))
+            if cur_id is None:
+                cur_id = str(ObjectId())
+                children[(parent_id, name.lower())] = cur_id
+                paths[cur_id] = paths[parent_id] + [{"folderId": cur_id, "name": name}]
+                new_folders[cur_id] = {
+                    "folderId": cur_id,
+                    "parent": parent_id,
+                    "name": name,
+                    "path": paths[cur_id],
+                }
+            elif cur_id not in paths:
+                paths[cur_id] = get_path(cur_id, container)
+        return cur_id
+
+    try:
+        for path, is_folder, size, read in iter_archive(request.stream, archive_format):
+            # Skip metadata that archivers add alongside the project
+            if not path or any(part.startswith(".") or part == "__MACOSX" for part in path):
+                continue
+
+            entry_name = "/".join(path)
+            folder_names = path if is_folder else path[:-1]
+            if any(not re.match(r"[\w\-.]+$", name) for name in folder_names):
+                return jsonify({"message": f"Invalid folder name in archive: {entry_name}."}), 400
+
+            if is_folder:
+                resolve_folder(folder_names)
+                continue
+
+            name = path[-1]
+            if not re.match(r"[\w\-.]+\.[\w]+$", name):
+                return jsonify({"message": f"Invalid filename in archive: {entry_name}."}), 400
+
+            if not name.lower().endswith((".java", ".py", ".c", ".h")):
+                return jsonify({
+                    "message": f"Can only save Java, Python or C (.c or .h) files. ({entry_name})"
+                }), 403
+
+            if size > 100 * 1024:
+                return jsonify({"message": f"File size exceeds the 100KB limit. ({entry_name})"}), 413
+
+            total_size += size
+            if container.get("size", 0) + total_size > CONTAINER_SIZE_LIMIT:
+                return jsonify({"message": "Container size limit of 5MB exceeded."}), 413
+
+            parent_id = resolve_folder(folder_names)
+            if (parent_id, name.lower()) in seen_files:
+                return jsonify({"message": f"Archive contains {entry_name} more than once."}), 409
+            seen_files.add((parent_id, name.lower()))
+
+            new_files.append({
+                "_id": ObjectId(),
+                "folder": parent_id,
+                "name": name,
+                "content": read(),
+            })
+    except ArchiveTooLarge as e:
+        return jsonify({"message": str(e)}), 413
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        return jsonify({"message": f"Invalid archive. {e}"}), 400
+
+    if not new_files and not new_folders:
+        return jsonify({"message": "Archive does not contain any files."}), 400
+
+    existing_folders = {file["folder"] for file in new_files} - set(new_folders)
+    existing_files = files.find(
+        {
+            "containerId": ObjectId(container_id),
+            "folder": {"$in": [get_folder_id(cur_id) for cur_id in existing_folders]},
+        },
+        {"folder": 1, "name": 1},
+    )
+    for file in existing_files:
+        if (str(file["folder"]), file["name"].lower()) in seen_files:
+            return jsonify({"message": f"File with this name already exists: {file['name']}."}), 409
+
+    # Sizes are recounted from the contents, as archive headers may not match them
+    total_size = sum(len(file["content"]) for file in new_files)
+    if not adjust_container_size(container_id, total_size, timestamp):
+        return jsonify({"message": "Container size limit of 5MB exceeded."}), 413
+
+    for file in new_files:
+        file["key"] = get_key_string(
+            container_id, [entry["name"] for entry in paths[file["folder"]]], file["name"]
+        )
+    etags, failed = put_s3_objects({file["key"]: file["content"] for file in new_files})
+    if failed:
+        delete_s3_objects(list(etags))
+        adjust_container_size(container_id, -total_size, timestamp)
+        return jsonify({
+            "message": "Error uploading archive contents to S3.",
+            "failed": [{"key": key, "error": error} for key, error in failed.items()],
+        }), 500
+
+    container_updates = {
+        **{f"folders.{cur_id}": cur_folder for cur_id, cur_folder in new_folders.items()},
+        "lastModified": timestamp,
+    }
+    if container["entryPoint"] is None and new_files:
+        container_updates["entryPoint"] = new_files[0]["_id"]
+
+    def write_archive(session):
+        if new_folders:
+            folders.insert_many(
+                [
+                    {
+                        "_id": ObjectId(cur_id),
+                        "containerId": ObjectId(container_id),
+                        "createdBy": request.user["sub"],
+                        "parent": get_folder_id(cur_folder["parent"]),
+                        "name": cur_folder["name"],
+                        "created": timestamp,
+                        "lastModified": timestamp,
+                    }
+                    for cur_id, cur_folder in new_folders.items()
+                ],
+                session=session,
+            )
+        if new_files:
+            files.insert_many(
+                [
+                    {
+                        "_id": file["_id"],
+                        "containerId": ObjectId(container_id),
+                        "createdBy": request.user["sub"],
+                        "folder": get_folder_id(file["folder"]),
+                        "key": file["key"],
+                        "etag": etags[file["key"]],
+                        "size": len(file["content"]),
+                        "name": file["name"],
+                        "nameTokens": get_name_tokens(file["name"]),
+                        "created": timestamp,
+                        "lastModified": timestamp,
+                    }
+                    for file in new_files
+                ],
+                session=session,
+            )
+        containers.update_one(
+            {"_id": ObjectId(container_id)}, {"$set": container_updates}, session=session
+        )
+
+    try:
+        run_in_transaction(write_archive)
+    except Exception as e:
+        # Without transactions some rows may have been written; their IDs are new
+        folders.delete_many({"_id": {"$in": [ObjectId(cur_id) for cur_id in new_folders]}})
+        files.delete_many({"_id": {"$in": [file["_id"] for file in new_files]}})
+        delete_s3_objects(list(etags))
+        adjust_container_size(container_id, -total_size, timestamp)
+        return jsonify({"message": f"Error saving archive contents. {e}"}), 500
+
+    for file in new_files:
+        content_cache.set(file["key"], etags[file["key"]], file["content"])
+
+    return jsonify(
+        {
+            "folders": list(new_folders),
+            "files": [
+                {"fileId": str(file["_id"]), "folderId": file["folder"], "name": file["name"]}
+                for file in new_files
+            ],
+            "delta": total_size,
+        }
+    ), 201
@@ -2,45 +2,48 @@ from bson import ObjectId
 from flask import Blueprint, jsonify, request
 from flask import current_app as app
 
-from cloudcontain_api.utils.auth import require_auth
+from cloudcontain_api.utils.auth import require_auth, require_container_access
+from cloudcontain_api.utils.constants import (
+    LOG_PAGE_SIZE,
+    LOG_PAGE_SIZE_MAX,
+)
+from cloudcontain_api.utils.utils import decode_cursor, encode_cursor
 
 jobs_bp = Blueprint("jobs", __name__)
 
 
 @jobs_bp.route("/containers/<container_id>/jobs/<job_id>/logs", methods=["GET"])
 @require_auth
+@require_container_access(action="access this container's job logs")
 def get_job_logs(container_id, job_id):
-    offset = int(request.args.get("offset", 0))
-    containers = app.db["containers"]
+    cursor = request.args.get("cursor")
+    direction = request.args.get("direction", "older")
+    limit = min(max(int(request.args.get("limit", LOG_PAGE_SIZE)), 1), LOG_PAGE_SIZE_MAX)
     jobs = app.db["jobs"]
     logs = app.db["logs"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
-
-    if container:
-        job = jobs.find_one(
-            {"_id": ObjectId(job_id), "containerId": ObjectId(container_id)}
-        )
-
-        if job:
-            # BUG: Daemon is not publising the NS timestamp correctly, so we cannot sort by it.
-            # Need to fix this, it should be publishing so that it can accurately sort by chronological order,
-            # still needs to use timestamp to convert from UTC to local time on the client side.
-            query_result = logs.aggregate(
-                [
-                    {"$match": {"jobId": ObjectId(job_id)}},
-                    {"$sort": {"ns": -1}},
-                    {"$limit": offset + 10},
-                    {"$skip": offset},
-                ]
+    if direction not in ("older", "newer"):
+        return jsonify({"message": "Direction must be either 'older' or 'newer'."}), 400
+
+    job = jobs.find_one(
+        {"_id": ObjectId(job_id), "containerId": ObjectId(container_id)}
+    )
+
+    if job:
+        # BUG: Daemon is not publising the NS timestamp correctly, so we cannot sort by it.
+        # Need to fix this, it should be publishing so that it can accurately sort by chronological order,
+        # still needs to use timestamp to convert from UTC to local time on the client side.
+        query = {"jobId": ObjectId(job_id)}
+
+        # Clients written against offset paging still get a bare list of 10 logs,
+        # oldest first, skipping `offset` of the newest
+        if "offset" in request.args and not cursor:
+            query_result = (
+                logs.find(query)
+                .sort([("ns", -1), ("_id", -1)])
+                .skip(int(request.args["offset"]))
+                .limit(10)
             )
-
             results = [
                 {
                     "content": log["content"],
@@ -50,66 +53,97 @@ def get_job_logs(container_id, job_id):
                 }
                 for log in query_result
             ]
+            return jsonify(results[::-1]), 200
+
+        order = -1 if direction == "older" else 1
+
+        # Keyset pagination on (ns, _id) so every page is a bounded index range scan
+        if cursor:
+            position = decode_cursor(cursor)
+            if position is None:
+                return jsonify({"message": "Invalid cursor."}), 400
+
+            ns, log_id = position
+            op = "$lt" if direction == "older" else "$gt"
+            query["$or"] = [
+                {"ns": {op: ns}},
+                {"ns": ns, "_id": {op: log_id}},
+            ]
 
-            results = sorted(results, key=lambda log: log["ns"])
+        query_result = list(
+            logs.find(query)
+            .sort([("ns", order), ("_id", order)])
+            .limit(limit + 1)
+        )
+        has_more = len(query_result) > limit
+        query_result = query_result[:limit]
+        if direction == "older":
+            query_result.reverse()
 
-            return jsonify(results), 200
+        results = [
+            {
+                "content": log["content"],
+                "timestamp": str(log["timestamp"]),
+                "ns": log["ns"],
+                "level": log["level"],
+            }
+            for log in query_result
+        ]
 
-        else:
-            return jsonify({"message": "Job not found for this container."}), 404
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
         return jsonify({
-            "message": "User is not authorized to access this container's job logs."
-        }), 401
+            "logs": results,
+            "hasMore": has_more,
+            "olderCursor": (
+                encode_cursor(query_result[0]["ns"], query_result[0]["_id"])
+                if query_result else None
+            ),
+            "newerCursor": (
+                encode_cursor(query_result[-1]["ns"], query_result[-1]["_id"])
+                if query_result else cursor
+            ),
+        }), 200
+
     else:
-        return jsonify({"message": "Container not found."}), 404
+        return jsonify({"message": "Job not found for this container."}), 404
 
 
 @jobs_bp.route("/containers/<container_id>/jobs", methods=["GET"])
 @require_auth
+@require_container_access(action="access this container's job history")
 def list_jobs(container_id):
     offset = int(request.args.get("offset", 0))
-    containers = app.db["containers"]
     jobs = app.db["jobs"]
     logs = app.db["logs"]
 
-    container = containers.find_one({
-        "_id": ObjectId(container_id), 
-        "$or": [
-            {"owner": request.user["sub"]},
-            {"public": True}
-        ]
-    })
+    query_result = list(jobs.find(
+        {"containerId": ObjectId(container_id)}, limit=offset + 10, skip=offset
+    ).sort("queued", -1))
 
-    if container:
-        query_result = jobs.find(
-            {"containerId": ObjectId(container_id)}, limit=offset + 10, skip=offset
-        ).sort("queued", -1)
+    log_counts = {
+        group["_id"]: group["count"]
+        for group in logs.aggregate([
+            {"$match": {"jobId": {"$in": [job["_id"] for job in query_result]}}},
+            {"$group": {"_id": "$jobId", "count": {"$sum": 1}}},
+        ])
+    }
 
-        results = [
-            {
-                "jobId": str(job["_id"]),
-                "status": job["status"],
-                "queued": str(job["queued"]) if job["queued"] else None,
-                "started": str(job["started"]) if job["started"] else None,
-                "ended": str(job["ended"]) if job["ended"] else None,
-                "requestedBy": job["requestedBy"],
-                "node": str(job["node"]),
-                "logCount": logs.count_documents({"jobId": job["_id"]}),
-                "output": [],
-            }
-            for job in query_result
-        ]
+    results = [
+        {
+            "jobId": str(job["_id"]),
+            "status": job["status"],
+            "queued": str(job["queued"]) if job["queued"] else None,
+            "started": str(job["started"]) if job["started"] else None,
+            "ended": str(job["ended"]) if job["ended"] else None,
+            "requestedBy": job["requestedBy"],
+            "node": str(job["node"]),
+            "logCount": log_counts.get(job["_id"], 0),
+            "output": [],
+        }
+        for job in query_result
+    ]
 
-        return jsonify(results), 200
+    return jsonify(results), 200
 
-    elif containers.count_documents({"_id": ObjectId(container_id)}, limit=1) != 0:
-        return jsonify({
-            "message": "User is not authorized to access this container's job history."
-        }), 401
-    else:
-        return jsonify({"message": "Container not found."}), 404
-    
 
 @jobs_bp.route("/jobs", methods=["GET"])
 @require_auth
@@ -172,4 +206,4 @@ def list_recent_jobs():
         for job in results
     ]
 
-    return jsonify(formatted_results), 200
\ No newline at end of file
+    return jsonify(formatted_results), 200
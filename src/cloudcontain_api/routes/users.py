@@ -14,12 +14,13 @@ users_bp = Blueprint("users", __name__)
 @require_auth
 def get_user():
     users = app.db["users"]
-    containers = app.db["containers"]
+    usage = app.db["usage"]
 
     user = users.find_one({"authId": request.user["sub"]})
 
     if user:
-        containerCount = containers.count_documents({"owner": request.user["sub"]})
+        user_usage = usage.find_one({"_id": request.user["sub"]}, {"containers": 1})
+        containerCount = user_usage.get("containers", 0) if user_usage else 0
         return jsonify(
             {
                 "authId": user["authId"],
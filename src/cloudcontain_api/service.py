@@ -9,14 +9,21 @@ from cloudcontain_api.routes.files import files_bp
 from cloudcontain_api.routes.folders import folders_bp
 from cloudcontain_api.routes.jobs import jobs_bp
 from cloudcontain_api.routes.users import users_bp
+from cloudcontain_api.utils.access_logs import access_log_buffer
+from cloudcontain_api.utils.auth import container_cache, token_cache
+from cloudcontain_api.utils.cache import cache_stats_reporter
 from cloudcontain_api.utils.constants import (
     MONGO_CONN_STRING,
     MONGO_DB_NAME,
+    MONGO_ENSURE_INDEXES,
     PUSHER_APP_ID,
     PUSHER_CLUSTER,
     PUSHER_KEY,
     PUSHER_SECRET,
 )
+from cloudcontain_api.utils.indexes import ensure_indexes
+from cloudcontain_api.utils.outbox import job_dispatcher
+from cloudcontain_api.utils.utils import content_cache
 
 app = Flask(__name__)
 CORS(
@@ -30,6 +37,10 @@ CORS(
 
 db_client = MongoClient(MONGO_CONN_STRING)
 app.db = db_client[MONGO_DB_NAME]
+if MONGO_ENSURE_INDEXES:
+    ensure_indexes(app.db)
+container_cache.watch(app.db["containers"])
+access_log_buffer.start(app.db["access_logs"], app.db["containers"])
 
 app.s3 = boto3.resource("s3")
 app.sqs = boto3.client("sqs", region_name="us-west-1")
@@ -41,6 +52,12 @@ app.pusher = Pusher(
     secret=PUSHER_SECRET,
     cluster=PUSHER_CLUSTER,
 )
+job_dispatcher.start(app.db["outbox"], app.sqs, app.pusher)
+
+cache_stats_reporter.register("container", container_cache)
+cache_stats_reporter.register("content", content_cache)
+cache_stats_reporter.register("token", token_cache)
+cache_stats_reporter.start()
 
 app.register_blueprint(containers_bp)
 app.register_blueprint(files_bp)
@@ -0,0 +1,145 @@
+"""
+Replays historical jobs against the autoscaler's scaling policy to compare queue
+wait and node cost with and without the warm pool and predictive pre-scaling.
+
+Run with `python -m cloudcontain_api.simulate_autoscaler [--days 7]`. The demand
+model is built from the `NODE_MODEL_WEEKS` before the replayed window only.
+"""
+import argparse
+import math
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+from cloudcontain_api.autoscaler import DemandModel, get_target_nodes
+from cloudcontain_api.utils.constants import (
+    AUTOSCALER_INTERVAL,
+    MONGO_CONN_STRING,
+    MONGO_DB_NAME,
+    NODE_BOOT_SECONDS,
+    NODE_IDLE_TIMEOUT,
+    NODE_WARM_MIN,
+)
+
+
+def load_jobs(jobs, start, end, default_duration):
+    """
+    Returns (queued, duration) pairs, in seconds since `start`, for jobs queued in
+    the window. Jobs that never finished are given `default_duration`.
+    """
+    replay = []
+    for job in jobs.find(
+        {"queued": {"$gte": start, "$lt": end}},
+        {"queued": 1, "started": 1, "ended": 1},
+        sort=[("queued", 1)],
+    ):
+        duration = default_duration
+        if job.get("started") and job.get("ended"):
+            duration = (job["ended"] - job["started"]).total_seconds()
+        queued = job["queued"].replace(tzinfo=timezone.utc)
+        replay.append(((queued - start).total_seconds(), max(duration, 1.0)))
+    return replay
+
+
+def simulate(replay, start, end, policy, interval=AUTOSCALER_INTERVAL,
+             boot_seconds=NODE_BOOT_SECONDS, idle_timeout=NODE_IDLE_TIMEOUT):
+    """
+    Runs the replay at one-second resolution. Each node runs one job at a time,
+    comes up `boot_seconds` after launch, and is retired once idle for
+    `idle_timeout` while above the policy's target. `policy(now, queue_depth, busy)`
+    returns the target node count and is consulted every `interval` seconds.
+
+    Returns the per-job queue waits in seconds and the node-hours used.
+    """
+    duration = int((end - start).total_seconds())
+    interval = max(1, int(interval))
+    nodes = []  # [ready_at, busy_until, idle_since]
+    queue = []
+    waits = []
+    node_seconds = 0
+    next_job = 0
+
+    for now in range(duration):
+        while next_job < len(replay) and replay[next_job][0] <= now:
+            queue.append(replay[next_job])
+            next_job += 1
+
+        for node in nodes:
+            ready_at, busy_until, idle_since = node
+            if ready_at > now or busy_until > now:
+                continue
+            if queue:
+                queued, job_duration = queue.pop(0)
+                waits.append(now - queued)
+                node[1] = now + job_duration
+                node[2] = None
+            elif idle_since is None:
+                node[2] = now
+
+        if now % interval == 0:
+            busy = sum(1 for node in nodes if node[0] <= now < node[1])
+            target = policy(start + timedelta(seconds=now), len(queue), busy)
+            for _ in range(target - len(nodes)):
+                nodes.append([now + boot_seconds, 0, None])
+
+            surplus = len(nodes) - target
+            for node in sorted(nodes, key=lambda node: node[2] if node[2] is not None else math.inf):
+                if surplus <= 0 or node[2] is None or now - node[2] < idle_timeout:
+                    break
+                nodes.remove(node)
+                surplus -= 1
+
+        node_seconds += len(nodes)
+
+    # Jobs still queued at the end of the window waited at least until then
+    waits.extend(duration - queued for queued, _ in queue)
+    return waits, node_seconds / 3600
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def compare_policies(db, start, end, warm_min=NODE_WARM_MIN):
+    model = DemandModel.from_jobs(db["jobs"], start)
+    replay = load_jobs(db["jobs"], start, end, model.mean_duration or 60.0)
+
+    policies = {
+        "reactive": lambda now, queue_depth, busy: get_target_nodes(queue_depth, busy, 0, warm_min=0),
+        "warm": lambda now, queue_depth, busy: get_target_nodes(
+            queue_depth, busy, model.predicted_nodes(now), warm_min=warm_min
+        ),
+    }
+
+    report = {}
+    for name, policy in policies.items():
+        waits, node_hours = simulate(replay, start, end, policy)
+        report[name] = {
+            "jobs": len(waits),
+            "p50Wait": percentile(waits, 50),
+            "p95Wait": percentile(waits, 95),
+            "nodeHours": round(node_hours, 2),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the node autoscaler against job history.")
+    parser.add_argument("--days", type=int, default=7, help="length of the replayed window, ending now")
+    parser.add_argument("--warm-min", type=int, default=NODE_WARM_MIN, help="warm idle nodes to keep")
+    args = parser.parse_args()
+
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    end = datetime.now(timezone.utc)
+    report = compare_policies(db, end - timedelta(days=args.days), end, args.warm_min)
+
+    for name, result in report.items():
+        print(
+            f"{name}: {result['jobs']} jobs, p50 wait {result['p50Wait']:.0f}s, "
+            f"p95 wait {result['p95Wait']:.0f}s, {result['nodeHours']} node-hours"
+        )
+    saved = report["reactive"]["p95Wait"] - report["warm"]["p95Wait"]
+    print(f"p95 queue wait saved: {saved:.0f}s")
@@ -0,0 +1,104 @@
+"""
+Write-behind buffer for container access times.
+"""
+import atexit
+import threading
+
+from pymongo import UpdateOne
+
+from cloudcontain_api.utils.constants import (
+    ACCESS_LOG_FLUSH_INTERVAL,
+    ACCESS_LOG_FLUSH_SIZE,
+)
+
+
+class AccessLogBuffer:
+    """
+    Collects (user, container) access times in memory, keeping only the latest per
+    pair, and upserts them into `access_logs` with one bulk write every
+    `flush_interval` seconds, once `flush_size` pairs are pending, and at exit.
+    Pairs for containers that no longer exist are dropped at flush time, so a
+    flush racing a container delete does not recreate its rows.
+    """
+
+    def __init__(self, flush_interval=ACCESS_LOG_FLUSH_INTERVAL, flush_size=ACCESS_LOG_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._collection = None
+        self._containers = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self, collection, containers):
+        self._collection = collection
+        self._containers = containers
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self, user_id, container_id, timestamp):
+        key = (user_id, container_id)
+        with self._lock:
+            if key not in self._pending or self._pending[key] < timestamp:
+                self._pending[key] = timestamp
+            pending_count = len(self._pending)
+
+        if pending_count >= self.flush_size:
+            self._wake.set()
+
+    def discard(self, container_id):
+        with self._lock:
+            self._pending = {
+                key: timestamp
+                for key, timestamp in self._pending.items()
+                if key[1] != container_id
+            }
+
+    def flush(self):
+        if self._collection is None:
+            return
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            try:
+                existing = {
+                    container["_id"]
+                    for container in self._containers.find(
+                        {"_id": {"$in": list({container_id for _, container_id in pending})}},
+                        {"_id": 1},
+                    )
+                }
+                pending = {key: timestamp for key, timestamp in pending.items() if key[1] in existing}
+                if not pending:
+                    return
+
+                self._collection.bulk_write(
+                    [
+                        UpdateOne(
+                            {"containerId": container_id, "userId": user_id},
+                            {"$max": {"lastAccessed": timestamp}},
+                            upsert=True,
+                        )
+                        for (user_id, container_id), timestamp in pending.items()
+                    ],
+                    ordered=False,
+                )
+            except Exception:
+                # Put the batch back for the next flush, without overwriting newer times
+                for key, timestamp in pending.items():
+                    self.record(*key, timestamp)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+access_log_buffer = AccessLogBuffer()
@@ -0,0 +1,208 @@
+"""
+Streaming zip and tar.gz archives of container contents, and readers for uploaded
+archives.
+"""
+import io
+import tarfile
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudcontain_api.utils.constants import (
+    ARCHIVE_READ_AHEAD,
+    ARCHIVE_UPLOAD_MAX_BYTES,
+    S3_BUCKET_NAME,
+    S3_MAX_ATTEMPTS,
+    S3_MAX_WORKERS,
+)
+
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable sink that hands back whatever was written since the last
+    drain, so archive writers can feed a response stream.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ArchiveWriter:
+    """
+    Writes a zip or tar.gz archive entry by entry. Output is collected with `drain`
+    after each entry, so only the entry being written is held in memory.
+    """
+
+    def __init__(self, archive_format):
+        self.format = archive_format
+        self._buffer = _StreamBuffer()
+        if archive_format == "zip":
+            # zipfile falls back to data descriptors on unseekable output
+            self._archive = zipfile.ZipFile(self._buffer, mode="w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(fileobj=self._buffer, mode="w|gz")
+
+    def add_folder(self, name, modified):
+        if self.format == "zip":
+            info = zipfile.ZipInfo(f"{name}/", date_time=_get_zip_time(modified))
+            info.external_attr = 0o40755 << 16
+            self._archive.writestr(info, b"")
+        else:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = modified.timestamp()
+            self._archive.addfile(info)
+
+    def add_file(self, name, content, modified):
+        if self.format == "zip":
+            info = zipfile.ZipInfo(name, date_time=_get_zip_time(modified))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._archive.writestr(info, content)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o644
+            info.mtime = modified.timestamp()
+            self._archive.addfile(info, io.BytesIO(content))
+
+    def drain(self):
+        return self._buffer.drain()
+
+    def close(self):
+        self._archive.close()
+        return self._buffer.drain()
+
+
+def _get_zip_time(modified):
+    # Zip timestamps cannot predate 1980
+    return max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def stream_archive(client, archive_format, folders, files):
+    """
+    Yields the archive of `folders` ((name, modified) pairs) and `files` (dicts with
+    name, key and modified). File contents are fetched from S3 on a worker pool up to
+    `ARCHIVE_READ_AHEAD` files ahead of the one being written.
+    """
+    def read(key):
+        error = None
+        for _ in range(S3_MAX_ATTEMPTS):
+            try:
+                return client.get_object(Bucket=S3_BUCKET_NAME, Key=key)["Body"].read()
+            except Exception as e:
+                error = e
+        raise error
+
+    writer = ArchiveWriter(archive_format)
+    for name, modified in folders:
+        writer.add_folder(name, modified)
+    yield writer.drain()
+
+    with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, ARCHIVE_READ_AHEAD)) as executor:
+        remaining = iter(files)
+        pending = deque()
+
+        def schedule():
+            file = next(remaining, None)
+            if file:
+                pending.append((file, executor.submit(read, file["key"])))
+
+        for _ in range(ARCHIVE_READ_AHEAD):
+            schedule()
+
+        while pending:
+            file, content = pending.popleft()
+            schedule()
+            writer.add_file(file["name"], content.result(), file["modified"])
+            yield writer.drain()
+
+    yield writer.close()
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    Passes reads through to a stream, failing once more than max_bytes are read.
+    """
+
+    def __init__(self, stream, max_bytes):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._read += len(data)
+        if self._read > self._max_bytes:
+            raise ArchiveTooLarge(
+                f"Archive exceeds the {self._max_bytes // (1024 * 1024)}MB upload limit."
+            )
+        return data
+
+
+def _spool(stream, max_bytes):
+    # Zip directories sit at the end of the archive, so uploads are spooled to a
+    # temporary file (in memory while small) before they can be read
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    copied = 0
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        copied += len(chunk)
+        if copied > max_bytes:
+            spooled.close()
+            raise ArchiveTooLarge(f"Archive exceeds the {max_bytes // (1024 * 1024)}MB upload limit.")
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def iter_archive(stream, archive_format, max_bytes=ARCHIVE_UPLOAD_MAX_BYTES):
+    """
+    Yields (path, is_folder, size, read) for each entry of an uploaded zip or tar
+    archive, where path is the list of the entry's path components and read()
+    returns its contents. Tar archives are read straight off the stream, so read()
+    must be called before moving on to the next entry.
+    """
+    if archive_format == "zip":
+        with _spool(stream, max_bytes) as spooled, zipfile.ZipFile(spooled) as archive:
+            for info in archive.infolist():
+                path = [part for part in info.filename.split("/") if part]
+                yield path, info.is_dir(), info.file_size, lambda info=info: archive.read(info)
+        return
+
+    counted = _CountingReader(stream, max_bytes)
+    with tarfile.open(fileobj=counted, mode="r|*") as archive:
+        for member in archive:
+            if not (member.isfile() or member.isdir()):
+                continue
+            path = [part for part in member.name.split("/") if part and part != "."]
+            yield (
+                path,
+                member.isdir(),
+                member.size,
+                lambda member=member: archive.extractfile(member).read(),
+            )
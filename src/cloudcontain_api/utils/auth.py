@@ -2,20 +2,26 @@
 Utility functions for authentication and authorization using Auth0.
 """
 
-import requests
-from flask import jsonify, request
+import hashlib
+
+from bson import ObjectId
+from flask import current_app as app
+from flask import g, jsonify, request
 from jose import jwt
 
 from cloudcontain_api.utils.constants import (
     AUTH0_ALGORITHMS,
     AUTH0_API_IDENTIFIER,
     AUTH0_DOMAIN,
+    AUTH0_TOKEN_CACHE_SIZE,
+    CONTAINER_CACHE_SIZE,
+    CONTAINER_CACHE_TTL,
 )
+from cloudcontain_api.utils.cache import ContainerCache, LRUCache
+from cloudcontain_api.utils.jwks import jwks_store
 
-
-def get_jwks():
-    jwks_json = requests.get(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    return jwks_json.json()
+token_cache = LRUCache(AUTH0_TOKEN_CACHE_SIZE)
+container_cache = ContainerCache(CONTAINER_CACHE_SIZE, CONTAINER_CACHE_TTL)
 
 
 def require_auth(f):
@@ -25,38 +31,105 @@ def require_auth(f):
             return jsonify({"message": "Missing token"}), 401
 
         token = token.split()[1]
-        jwks = get_jwks()
-        unverified_header = jwt.get_unverified_header(token)
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"],
-                }
-        if not rsa_key:
-            return jsonify({"message": "Invalid token"}), 401
-
-        try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=AUTH0_ALGORITHMS,
-                audience=AUTH0_API_IDENTIFIER,
-                issuer=f"https://{AUTH0_DOMAIN}/",
-            )
-        except jwt.ExpiredSignatureError:
-            return jsonify({"message": "Token expired"}), 401
-        except jwt.JWTClaimsError:
-            return jsonify({"message": "Invalid claims"}), 401
-        except Exception:
-            return jsonify({"message": "Invalid token"}), 401
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        payload = token_cache.get(token_hash)
+
+        if payload is None:
+            unverified_header = jwt.get_unverified_header(token)
+            rsa_key = jwks_store.get_key(unverified_header.get("kid"))
+            if not rsa_key:
+                return jsonify({"message": "Invalid token"}), 401
+
+            try:
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=AUTH0_ALGORITHMS,
+                    audience=AUTH0_API_IDENTIFIER,
+                    issuer=f"https://{AUTH0_DOMAIN}/",
+                )
+            except jwt.ExpiredSignatureError:
+                return jsonify({"message": "Token expired"}), 401
+            except jwt.JWTClaimsError:
+                return jsonify({"message": "Invalid claims"}), 401
+            except Exception:
+                return jsonify({"message": "Invalid token"}), 401
+
+            # Only tokens with an expiry are cached, and never beyond it
+            if "exp" in payload:
+                token_cache.set(token_hash, payload, expires_at=payload["exp"])
 
         request.user = payload
         return f(*args, **kwargs)
 
     wrapper.__name__ = f.__name__
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def get_container_access(container_id, fields=(), cached=True):
+    """
+    Returns the owner, visibility and requested fields of a container, served from
+    the process-wide container cache when possible and memoized for the request.
+    The folder map is only loaded for routes that declare `folders`. With `cached`
+    off the container is always read from Mongo, and the fresh copy is cached.
+    """
+    if "container_access" not in g:
+        g.container_access = {}
+
+    with_folders = "folders" in fields
+    container = g.container_access.get(container_id, False)
+    missing_folders = container and with_folders and "folders" not in container
+    if container is False or not cached or missing_folders:
+        container = container_cache.get(container_id) if cached else None
+        if container is None or (with_folders and "folders" not in container):
+            generation = container_cache.get_generation()
+            container = app.db["containers"].find_one(
+                {"_id": ObjectId(container_id)},
+                None if with_folders else {"folders": 0},
+            )
+            if container:
+                container_cache.set(container_id, container, generation)
+        g.container_access[container_id] = container
+
+    container = g.container_access[container_id]
+    if not container:
+        return None
+    return {
+        field: container[field]
+        for field in ("_id", "owner", "public", *fields)
+        if field in container
+    }
+
+
+def require_container_access(owner=False, fields=(), action="access this container"):
+    """
+    Requires the caller to own the container in the `container_id` route argument,
+    or, unless `owner` is set, for it to be public. The container is made available
+    as `request.container` with only `fields` (plus owner and visibility) loaded.
+    Owner routes derive writes from it, so they read it from Mongo rather than a
+    cache entry that may be stale for another worker's changes.
+    """
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            container = get_container_access(kwargs["container_id"], fields, cached=not owner)
+            if not container:
+                return jsonify({"message": "Container not found."}), 404
+
+            if container["owner"] != request.user["sub"] and (owner or not container.get("public")):
+                return jsonify({
+                    "message": f"User is not authorized to {action}."
+                }), 401
+
+            request.container = container
+            try:
+                return f(*args, **kwargs)
+            finally:
+                # Writes through this process are visible to its next read immediately,
+                # even if the route failed partway; other workers pick them up from the
+                # change stream
+                if request.method != "GET":
+                    container_cache.invalidate(kwargs["container_id"])
+
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
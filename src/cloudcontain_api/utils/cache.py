@@ -0,0 +1,238 @@
+"""
+Thread-safe in-process caches shared by the API workers.
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cloudcontain_api.utils.constants import CACHE_STATS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache. Entries may carry an absolute expiry
+    (`time.time()` seconds) after which they are treated as misses.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+class ContainerCache:
+    """
+    Process-wide cache of container documents keyed by container ID. Entries are
+    invalidated from a change stream on the containers collection once `watch` is
+    running; without one (e.g. standalone servers) they expire after `ttl` seconds.
+    Documents are copied in and out so callers may mutate what they are given.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.ttl = ttl
+        self.watching = False
+        # Bumped on every invalidation so a read that raced a change is not cached
+        self.generation = 0
+        self._entries = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def get(self, container_id):
+        container = self._entries.get(container_id)
+        return copy.deepcopy(container) if container else None
+
+    def get_generation(self):
+        with self._lock:
+            return self.generation
+
+    def set(self, container_id, container, generation):
+        container = copy.deepcopy(container)
+        expires_at = None if self.watching else time.time() + self.ttl
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.set(container_id, container, expires_at)
+
+    def invalidate(self, container_id):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(container_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {**self._entries.stats(), "watching": self.watching}
+
+    def watch(self, collection):
+        threading.Thread(target=self._watch, args=(collection,), daemon=True).start()
+
+    def _watch(self, collection, retry_delay=1):
+        while True:
+            try:
+                with collection.watch() as stream:
+                    self.watching = True
+                    for change in stream:
+                        if "documentKey" in change:
+                            self.invalidate(str(change["documentKey"]["_id"]))
+                        else:
+                            self.clear()
+            except OperationFailure as e:
+                # Change streams need a replica set; stay on TTL expiry for good
+                if e.code in (40573, 20):
+                    self.watching = False
+                    self.clear()
+                    return
+                self._on_stream_lost()
+            except PyMongoError:
+                self._on_stream_lost()
+            time.sleep(retry_delay)
+
+    def _on_stream_lost(self):
+        # Changes may be missed until the stream reopens, so drop everything cached
+        self.watching = False
+        self.clear()
+
+
+class ContentCache:
+    """
+    Least-recently-used cache of object contents keyed by S3 key, bounded by the
+    total bytes held rather than the entry count. Each entry records the ETag of the
+    version it holds, and a lookup only hits for the ETag asked for.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, etag, content):
+        if len(content) > self.max_entry_bytes:
+            self.pop(key)
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self.bytes -= len(previous[1])
+
+            self._entries[key] = (etag, content)
+            self.bytes += len(content)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self.bytes -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+            }
+
+
+class CacheStatsReporter:
+    """
+    Logs the `stats()` of each registered cache every `interval` seconds.
+    """
+
+    def __init__(self, interval=CACHE_STATS_INTERVAL):
+        self.interval = interval
+        self._caches = {}
+
+    def register(self, name, cache):
+        self._caches[name] = cache
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def report(self):
+        for name, cache in self._caches.items():
+            logger.info("%s cache: %s", name, cache.stats())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+
+cache_stats_reporter = CacheStatsReporter()
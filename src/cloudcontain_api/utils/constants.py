@@ -7,15 +7,60 @@ load_dotenv()
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 AUTH0_API_IDENTIFIER = os.getenv("AUTH0_API_IDENTIFIER")
 AUTH0_ALGORITHMS = ["RS256"]
+AUTH0_JWKS_TTL = int(os.getenv("AUTH0_JWKS_TTL", 3600))
+AUTH0_JWKS_REFETCH_INTERVAL = int(os.getenv("AUTH0_JWKS_REFETCH_INTERVAL", 30))
+AUTH0_TOKEN_CACHE_SIZE = int(os.getenv("AUTH0_TOKEN_CACHE_SIZE", 4096))
 
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", 16))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 3))
+S3_DELETE_BATCH_SIZE = 1000
+S3_STREAM_CHUNK_MIN = int(os.getenv("S3_STREAM_CHUNK_MIN", 4096))
+S3_STREAM_CHUNK_MAX = int(os.getenv("S3_STREAM_CHUNK_MAX", 64 * 1024))
+
+FILE_BATCH_MAX_FILES = int(os.getenv("FILE_BATCH_MAX_FILES", 100))
+
+ARCHIVE_READ_AHEAD = int(os.getenv("ARCHIVE_READ_AHEAD", 8))
+ARCHIVE_UPLOAD_MAX_BYTES = int(os.getenv("ARCHIVE_UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
 
 SQS_URL = os.getenv("SQS_URL")
 
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_BATCH_SIZE = 10  # SQS send_message_batch and Pusher trigger_batch maximum
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 30))
+OUTBOX_MAX_BACKOFF = int(os.getenv("OUTBOX_MAX_BACKOFF", 300))
+
+LOG_PAGE_SIZE = int(os.getenv("LOG_PAGE_SIZE", 10))
+LOG_PAGE_SIZE_MAX = int(os.getenv("LOG_PAGE_SIZE_MAX", 100))
+
 JOB_NODE_AMI_ID = os.getenv("JOB_NODE_AMI_ID")
+NODE_INSTANCE_TYPE = os.getenv("NODE_INSTANCE_TYPE", "t3.small")
+NODE_MAX_COUNT = int(os.getenv("NODE_MAX_COUNT", 3))
+NODE_JOBS_PER_NODE = int(os.getenv("NODE_JOBS_PER_NODE", 20))
+NODE_IDLE_TIMEOUT = int(os.getenv("NODE_IDLE_TIMEOUT", 300))
+NODE_LAUNCH_TIMEOUT = int(os.getenv("NODE_LAUNCH_TIMEOUT", 600))
+NODE_BOOT_SECONDS = int(os.getenv("NODE_BOOT_SECONDS", 180))
+NODE_WARM_MIN = int(os.getenv("NODE_WARM_MIN", 1))
+NODE_MODEL_WEEKS = int(os.getenv("NODE_MODEL_WEEKS", 4))
+NODE_MODEL_REFRESH = int(os.getenv("NODE_MODEL_REFRESH", 3600))
+NODE_PRESCALE_MIN_RATE = float(os.getenv("NODE_PRESCALE_MIN_RATE", 1))
+AUTOSCALER_INTERVAL = float(os.getenv("AUTOSCALER_INTERVAL", 10))
 
 MONGO_CONN_STRING = os.getenv("MONGO_CONN_STRING")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+
+CONTAINER_SIZE_LIMIT = 5 * 1024 * 1024
+
+CONTAINER_CACHE_SIZE = int(os.getenv("CONTAINER_CACHE_SIZE", 1024))
+CONTAINER_CACHE_TTL = int(os.getenv("CONTAINER_CACHE_TTL", 5))
+
+CONTENT_CACHE_BYTES = int(os.getenv("CONTENT_CACHE_BYTES", 64 * 1024 * 1024))
+CONTENT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CONTENT_CACHE_MAX_ENTRY_BYTES", 128 * 1024))
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", 300))
+
+ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", 5))
+ACCESS_LOG_FLUSH_SIZE = int(os.getenv("ACCESS_LOG_FLUSH_SIZE", 500))
 
 PUSHER_APP_ID = os.getenv("PUSHER_APP_ID")
 PUSHER_KEY = os.getenv("PUSHER_KEY")
@@ -0,0 +1,133 @@
+"""
+Indexes required by the route queries, created on startup.
+
+Run `python -m cloudcontain_api.utils.indexes` to create them, or with `--check`
+to explain every registered query shape and fail if any falls back to a COLLSCAN.
+"""
+import argparse
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.collation import Collation
+
+from cloudcontain_api.utils.constants import MONGO_CONN_STRING, MONGO_DB_NAME
+
+# Case-insensitive comparison used for file and folder name uniqueness checks
+NAME_COLLATION = Collation(locale="en", strength=2)
+
+INDEXES = {
+    "containers": [
+        IndexModel([("owner", ASCENDING), ("created", DESCENDING)]),
+        IndexModel([("owner", ASCENDING), ("nameTokens", ASCENDING)]),
+    ],
+    "files": [
+        IndexModel([("containerId", ASCENDING), ("folder", ASCENDING)]),
+        IndexModel(
+            [("containerId", ASCENDING), ("folder", ASCENDING), ("name", ASCENDING)],
+            collation=NAME_COLLATION,
+        ),
+        IndexModel([("containerId", ASCENDING), ("nameTokens", ASCENDING)]),
+    ],
+    "folders": [
+        IndexModel([("containerId", ASCENDING), ("parent", ASCENDING)]),
+        IndexModel(
+            [("containerId", ASCENDING), ("parent", ASCENDING), ("name", ASCENDING)],
+            collation=NAME_COLLATION,
+        ),
+    ],
+    "jobs": [
+        IndexModel([("containerId", ASCENDING), ("queued", DESCENDING)]),
+        IndexModel([("containerId", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("requestedBy", ASCENDING), ("queued", DESCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("queued", ASCENDING)]),
+    ],
+    "nodes": [
+        IndexModel([("alive", ASCENDING), ("idleSince", ASCENDING)]),
+        IndexModel([("pending", ASCENDING), ("launched", ASCENDING)]),
+    ],
+    "logs": [
+        IndexModel([("jobId", ASCENDING), ("ns", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "outbox": [
+        IndexModel([("nextAttempt", ASCENDING)]),
+        IndexModel([("created", ASCENDING)]),
+    ],
+    "access_logs": [
+        IndexModel([("userId", ASCENDING), ("lastAccessed", DESCENDING)]),
+        IndexModel([("containerId", ASCENDING), ("userId", ASCENDING)]),
+    ],
+    "users": [
+        IndexModel([("authId", ASCENDING)]),
+    ],
+}
+
+# Representative filters for every query the routes issue, used by check_query_plans
+_ID = ObjectId()
+QUERY_SHAPES = [
+    ("containers", {"owner": "user"}, {"created": -1}, None),
+    ("containers", {"owner": "user", "nameTokens": {"$all": ["abc"]}}, None, None),
+    ("files", {"containerId": _ID, "folder": "~"}, None, None),
+    ("files", {"containerId": _ID, "folder": {"$in": ["~", _ID]}}, None, None),
+    ("files", {"containerId": _ID, "folder": "~", "name": "main.py"}, None, NAME_COLLATION),
+    ("files", {"containerId": _ID, "nameTokens": {"$all": ["mai"]}}, None, None),
+    ("folders", {"containerId": _ID, "parent": "~"}, None, None),
+    ("folders", {"containerId": _ID, "parent": "~", "name": "src"}, None, NAME_COLLATION),
+    ("jobs", {"containerId": _ID}, {"queued": -1}, None),
+    ("jobs", {"containerId": _ID, "status": {"$nin": ["COMPLETED", "FAILED"]}}, None, None),
+    ("jobs", {"requestedBy": "user"}, {"queued": -1}, None),
+    ("jobs", {"status": {"$in": ["STARTING_NODE", "PENDING"]}}, None, None),
+    ("jobs", {"queued": {"$gte": _ID.generation_time, "$lt": _ID.generation_time}}, None, None),
+    ("nodes", {"alive": True, "idleSince": {"$lte": _ID.generation_time}}, {"idleSince": 1}, None),
+    ("nodes", {"pending": True, "launched": {"$lte": _ID.generation_time}}, None, None),
+    ("logs", {"jobId": _ID}, {"ns": -1, "_id": -1}, None),
+    ("outbox", {"nextAttempt": {"$lte": _ID.generation_time}}, {"nextAttempt": 1}, None),
+    ("access_logs", {"userId": "user"}, {"lastAccessed": -1}, None),
+    ("access_logs", {"containerId": _ID, "userId": "user"}, None, None),
+    ("users", {"authId": "user"}, None, None),
+]
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        db[collection].create_indexes(indexes)
+
+
+def _find_stages(plan):
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [plan.get("inputStage", {})]:
+        if child:
+            yield from _find_stages(child)
+
+
+def check_query_plans(db):
+    failures = []
+    for collection, query_filter, sort, collation in QUERY_SHAPES:
+        command = {"find": collection, "filter": query_filter}
+        if sort:
+            command["sort"] = sort
+        if collation:
+            command["collation"] = collation.document
+
+        explain = db.command("explain", command, verbosity="queryPlanner")
+        plan = explain["queryPlanner"]["winningPlan"]
+        # Slot-based execution nests the classic plan under queryPlan
+        plan = plan.get("queryPlan", plan)
+        if "COLLSCAN" in _find_stages(plan):
+            failures.append((collection, query_filter))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or verify the API's MongoDB indexes.")
+    parser.add_argument("--check", action="store_true", help="fail if any route query plan is a COLLSCAN")
+    args = parser.parse_args()
+
+    db = MongoClient(MONGO_CONN_STRING)[MONGO_DB_NAME]
+    ensure_indexes(db)
+    if args.check:
+        failures = check_query_plans(db)
+        for collection, query_filter in failures:
+            print(f"COLLSCAN: {collection} {query_filter}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,100 @@
+"""
+In-process cache of the Auth0 JSON Web Key Set used to verify access tokens.
+"""
+import threading
+import time
+
+import requests
+from jose import jwk
+
+from cloudcontain_api.utils.constants import (
+    AUTH0_ALGORITHMS,
+    AUTH0_DOMAIN,
+    AUTH0_JWKS_REFETCH_INTERVAL,
+    AUTH0_JWKS_TTL,
+)
+
+
+class JWKSKeyStore:
+    """
+    Parses signing keys once and serves them from memory. Keys are refreshed in the
+    background once they are older than `ttl`, and a token carrying an unknown `kid`
+    forces a synchronous refetch at most once every `refetch_interval` seconds. If a
+    refresh fails, the previously fetched keys keep being served.
+    """
+
+    def __init__(self, url, ttl=AUTH0_JWKS_TTL, refetch_interval=AUTH0_JWKS_REFETCH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        if self._fetched_at is None:
+            # Nothing has loaded yet, so there is nothing to serve while refetching
+            if self._can_refetch():
+                self.refresh()
+        elif time.monotonic() - self._fetched_at > self.ttl and self._can_refetch():
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._can_refetch():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        with self._lock:
+            self._last_attempt = time.monotonic()
+        try:
+            response = requests.get(self.url, timeout=5)
+            response.raise_for_status()
+            keys = {
+                key["kid"]: jwk.construct(
+                    {
+                        "kty": key["kty"],
+                        "kid": key["kid"],
+                        "use": key["use"],
+                        "n": key["n"],
+                        "e": key["e"],
+                    },
+                    algorithm=AUTH0_ALGORITHMS[0],
+                )
+                for key in response.json()["keys"]
+            }
+        except Exception:
+            return False
+
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return True
+
+    def _can_refetch(self):
+        with self._lock:
+            if self._last_attempt is None:
+                return True
+            return time.monotonic() - self._last_attempt >= self.refetch_interval
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+jwks_store = JWKSKeyStore(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
@@ -0,0 +1,198 @@
+"""
+Transactional outbox for job dispatch. Jobs are queued by inserting an outbox entry
+alongside the job document; a background dispatcher delivers the entries to SQS and
+Pusher in batches.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+from cloudcontain_api.utils.constants import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_BACKOFF,
+    OUTBOX_POLL_INTERVAL,
+    SQS_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_job_outbox_entry(job_id, container_id, job_status, queued_time):
+    return {
+        "_id": job_id,
+        "channel": str(container_id),
+        "event": "job-queued",
+        "data": {
+            "jobId": str(job_id),
+            "status": job_status,
+            "queued": str(queued_time),
+            "started": None,
+            "ended": None,
+            "node": None,
+            "output": [],
+        },
+        "message": json.dumps(
+            {
+                "jobId": str(job_id),
+                "containerId": str(container_id),
+                "queued": str(queued_time),
+            }
+        ),
+        "pusherSent": False,
+        "sqsSent": False,
+        "attempts": 0,
+        "created": queued_time,
+        "nextAttempt": queued_time,
+    }
+
+
+class JobDispatcher:
+    """
+    Drains the `outbox` collection. Entries are claimed with a lease so several
+    workers can run the dispatcher at once, sent with one SQS `send_message_batch`
+    and one Pusher `trigger_batch` per batch, and retried with exponential backoff
+    until both deliveries succeed.
+    """
+
+    def __init__(self):
+        self.last_lag = None
+        self._outbox = None
+        self._sqs = None
+        self._pusher = None
+        self._wake = threading.Event()
+
+    def start(self, outbox, sqs, pusher):
+        self._outbox = outbox
+        self._sqs = sqs
+        self._pusher = pusher
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def notify(self):
+        self._wake.set()
+
+    def stats(self):
+        """
+        Pending entry count, seconds the oldest of them has waited, and the queue-to-send
+        lag of the most recently delivered entry.
+        """
+        oldest = self._outbox.find_one({}, {"created": 1}, sort=[("created", 1)])
+        lag = 0.0
+        if oldest:
+            created = oldest["created"].replace(tzinfo=timezone.utc)
+            lag = (datetime.now(timezone.utc) - created).total_seconds()
+        return {
+            "pending": self._outbox.estimated_document_count(),
+            "lag": lag,
+            "lastLag": self.last_lag,
+        }
+
+    def dispatch(self):
+        batch = self._claim()
+        if not batch:
+            return 0
+
+        sqs_failed = self._send_sqs([entry for entry in batch if not entry["sqsSent"]])
+        pusher_failed = self._send_pusher([entry for entry in batch if not entry["pusherSent"]])
+
+        now = datetime.now(timezone.utc)
+        for entry in batch:
+            sqs_sent = entry["sqsSent"] or entry["_id"] not in sqs_failed
+            pusher_sent = entry["pusherSent"] or entry["_id"] not in pusher_failed
+            if sqs_sent and pusher_sent:
+                self._outbox.delete_one({"_id": entry["_id"]})
+                created = entry["created"].replace(tzinfo=timezone.utc)
+                self.last_lag = (now - created).total_seconds()
+                continue
+
+            backoff = min(2 ** entry["attempts"], OUTBOX_MAX_BACKOFF)
+            logger.warning(
+                "Delivery of job %s failed (sqs sent: %s, pusher sent: %s), retrying in %ds",
+                entry["_id"], sqs_sent, pusher_sent, backoff,
+            )
+            self._outbox.update_one(
+                {"_id": entry["_id"]},
+                {
+                    "$set": {
+                        "sqsSent": sqs_sent,
+                        "pusherSent": pusher_sent,
+                        "nextAttempt": now + timedelta(seconds=backoff),
+                    },
+                    "$inc": {"attempts": 1},
+                },
+            )
+        return len(batch)
+
+    def _claim(self):
+        now = datetime.now(timezone.utc)
+        batch = []
+        while len(batch) < OUTBOX_BATCH_SIZE:
+            entry = self._outbox.find_one_and_update(
+                {"nextAttempt": {"$lte": now}},
+                {"$set": {"nextAttempt": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+                sort=[("nextAttempt", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if not entry:
+                break
+            batch.append(entry)
+        return batch
+
+    def _send_sqs(self, entries):
+        if not entries:
+            return set()
+        try:
+            response = self._sqs.send_message_batch(
+                QueueUrl=SQS_URL,
+                Entries=[
+                    {
+                        "Id": str(entry["_id"]),
+                        "MessageBody": entry["message"],
+                        "MessageGroupId": entry["channel"],
+                        "MessageDeduplicationId": str(entry["_id"]),
+                    }
+                    for entry in entries
+                ],
+            )
+        except Exception:
+            return {entry["_id"] for entry in entries}
+
+        failed_ids = {failure["Id"] for failure in response.get("Failed", [])}
+        return {entry["_id"] for entry in entries if str(entry["_id"]) in failed_ids}
+
+    def _send_pusher(self, entries):
+        if not entries:
+            return set()
+        try:
+            self._pusher.trigger_batch([
+                {"channel": entry["channel"], "name": entry["event"], "data": entry["data"]}
+                for entry in entries
+            ])
+        except Exception:
+            return {entry["_id"] for entry in entries}
+        return set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                # Keep draining while full batches come back
+                dispatched = 0
+                while True:
+                    count = self.dispatch()
+                    dispatched += count
+                    if count < OUTBOX_BATCH_SIZE:
+                        break
+                if dispatched:
+                    logger.info("Dispatched %d outbox entries: %s", dispatched, self.stats())
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+                time.sleep(OUTBOX_POLL_INTERVAL)
+
+
+job_dispatcher = JobDispatcher()
@@ -0,0 +1,193 @@
+"""
+Per-user usage counters backing the container and job quotas.
+
+Each user's `usage` document holds their container count and their job submissions
+bucketed by UTC day, both maintained with `$inc`, so a quota check is a single read
+by `_id`. Container sizes are likewise kept with conditional `$inc` updates.
+
+The `backfill_usage` migration recomputes every usage document and container size
+from the containers, jobs and files collections to seed them and correct drift.
+"""
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+JOB_WINDOW_DAYS = 30
+
+
+def get_day_bucket(timestamp):
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def get_window_start(now):
+    return get_day_bucket(now - timedelta(days=JOB_WINDOW_DAYS - 1))
+
+
+def count_recent_jobs(usage, now):
+    """
+    Jobs submitted in the last `JOB_WINDOW_DAYS` days, counted by whole UTC days.
+    """
+    window_start = get_window_start(now)
+    return sum(
+        count
+        for day, count in (usage or {}).get("jobs", {}).items()
+        if day >= window_start
+    )
+
+
+def reserve_container(usage, user_id, limit, session=None):
+    """
+    Counts a new container against the user's quota, or returns False if they
+    already have `limit` containers.
+    """
+    try:
+        usage.update_one(
+            {
+                "_id": user_id,
+                # Documents created by record_job have no container count yet
+                "$or": [{"containers": {"$lt": limit}}, {"containers": {"$exists": False}}],
+            },
+            {"$inc": {"containers": 1}},
+            upsert=True,
+            session=session,
+        )
+    except DuplicateKeyError:
+        # The user's document exists but is at the limit, so the upsert tried to insert
+        return False
+    return True
+
+
+def release_container(usage, user_id, session=None):
+    usage.update_one({"_id": user_id}, {"$inc": {"containers": -1}}, session=session)
+
+
+def record_job(usage, user_id, user_usage, now, session=None):
+    """
+    Counts a job in today's bucket and drops buckets that have left the window.
+    `user_usage` is the document read for the quota check.
+    """
+    window_start = get_window_start(now)
+    update = {"$inc": {f"jobs.{get_day_bucket(now)}": 1}}
+    expired = {
+        f"jobs.{day}": ""
+        for day in (user_usage or {}).get("jobs", {})
+        if day < window_start
+    }
+    if expired:
+        update["$unset"] = expired
+    usage.update_one({"_id": user_id}, update, upsert=True, session=session)
+
+
+def release_jobs(usage, jobs, container_id, now, session=None):
+    """
+    Removes a container's jobs from their requesters' buckets before they are deleted.
+    """
+    removed = jobs.aggregate([
+        {
+            "$match": {
+                "containerId": container_id,
+                "queued": {"$gte": now - timedelta(days=JOB_WINDOW_DAYS)},
+            }
+        },
+        {
+            "$group": {
+                "_id": {
+                    "user": "$requestedBy",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$queued"}},
+                },
+                "count": {"$sum": 1},
+            }
+        },
+    ], session=session)
+
+    decrements = {}
+    for bucket in removed:
+        user_decrements = decrements.setdefault(bucket["_id"]["user"], {})
+        user_decrements[f"jobs.{bucket['_id']['day']}"] = -bucket["count"]
+
+    if decrements:
+        usage.bulk_write(
+            [
+                UpdateOne({"_id": user_id}, {"$inc": user_decrements})
+                for user_id, user_decrements in decrements.items()
+            ],
+            ordered=False,
+            session=session,
+        )
+
+
+def reconcile_usage(db, now=None):
+    """
+    Recomputes every user's usage document from the containers and jobs collections.
+    """
+    now = now or datetime.now(timezone.utc)
+    usage = {
+        doc["_id"]: {"containers": 0, "jobs": {}}
+        for doc in db["usage"].find({}, {"_id": 1})
+    }
+
+    for row in db["containers"].aggregate([
+        {"$group": {"_id": "$owner", "count": {"$sum": 1}}},
+    ]):
+        usage.setdefault(row["_id"], {"containers": 0, "jobs": {}})["containers"] = row["count"]
+
+    for row in db["jobs"].aggregate([
+        {"$match": {"queued": {"$gte": now - timedelta(days=JOB_WINDOW_DAYS)}}},
+        {
+            "$group": {
+                "_id": {
+                    "user": "$requestedBy",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$queued"}},
+                },
+                "count": {"$sum": 1},
+            }
+        },
+    ]):
+        user_usage = usage.setdefault(row["_id"]["user"], {"containers": 0, "jobs": {}})
+        user_usage["jobs"][row["_id"]["day"]] = row["count"]
+
+    if usage:
+        db["usage"].bulk_write(
+            [
+                UpdateOne({"_id": user_id}, {"$set": user_usage}, upsert=True)
+                for user_id, user_usage in usage.items()
+            ],
+            ordered=False,
+        )
+    return len(usage)
+
+
+def recompute_container_sizes(db, now=None, settle_seconds=60):
+    """
+    Resets each container's size to the sum of its files' sizes where they disagree.
+    Containers modified in the last `settle_seconds`, or while the pass runs, are
+    left for the next pass so in-flight saves are not overwritten.
+    """
+    now = now or datetime.now(timezone.utc)
+    settled = now - timedelta(seconds=settle_seconds)
+    containers = db["containers"]
+
+    recorded = {
+        container["_id"]: container.get("size", 0)
+        for container in containers.find({"lastModified": {"$lt": settled}}, {"size": 1})
+    }
+    actual = {
+        row["_id"]: row["size"]
+        for row in db["files"].aggregate([
+            {"$match": {"containerId": {"$in": list(recorded)}}},
+            {"$group": {"_id": "$containerId", "size": {"$sum": "$size"}}},
+        ])
+    }
+
+    repairs = [
+        UpdateOne(
+            {"_id": container_id, "size": size, "lastModified": {"$lt": settled}},
+            {"$set": {"size": actual.get(container_id, 0)}},
+        )
+        for container_id, size in recorded.items()
+        if actual.get(container_id, 0) != size
+    ]
+    if repairs:
+        return containers.bulk_write(repairs, ordered=False).modified_count
+    return 0
@@ -1,39 +1,192 @@
 """
 Utility functions for container and file management and interaction with AWS services.
 """
+import base64
+import json
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
 from bson import ObjectId
 from flask import current_app as app
+from pymongo.errors import OperationFailure
+
+from cloudcontain_api.utils.cache import ContentCache
+from cloudcontain_api.utils.constants import (
+    CONTAINER_SIZE_LIMIT,
+    CONTENT_CACHE_BYTES,
+    CONTENT_CACHE_MAX_ENTRY_BYTES,
+    S3_BUCKET_NAME,
+    S3_DELETE_BATCH_SIZE,
+    S3_MAX_ATTEMPTS,
+    S3_MAX_WORKERS,
+    S3_STREAM_CHUNK_MAX,
+    S3_STREAM_CHUNK_MIN,
+)
 
-from cloudcontain_api.utils.constants import S3_BUCKET_NAME
+content_cache = ContentCache(CONTENT_CACHE_BYTES, CONTENT_CACHE_MAX_ENTRY_BYTES)
 
 
 def get_path(folder, container, include_all=True):
+    if folder == "~":
+        return []
+
+    cur_folder = container["folders"].get(folder)
+    if not cur_folder:
+        return -1
+
+    # Folders created before paths were materialized fall back to walking parents
+    path = cur_folder.get("path") or build_folder_path(folder, container["folders"])
+    if include_all:
+        return list(path)
+    return [entry["name"] for entry in path]
+
+
+def build_folder_path(folder_id, folders):
     path = []
-    if folder != "~":
-        cur_folder = container["folders"][folder]
-        if not cur_folder:
-            return -1
-        else:
-            while True:
-                if include_all:
-                    path.insert(0,
-                        {
-                            "folderId": cur_folder["folderId"], 
-                            "name": cur_folder["name"]
-                        },
-                    )
-                else:
-                    path.insert(0, cur_folder["name"])
-                if cur_folder["parent"] == "~":
-                    break
-                cur_folder = container["folders"][cur_folder["parent"]]
+    while folder_id != "~":
+        cur_folder = folders[folder_id]
+        path.append({"folderId": cur_folder["folderId"], "name": cur_folder["name"]})
+        folder_id = cur_folder["parent"]
+    path.reverse()
     return path
 
 
+def update_folder_paths(folder_id, folders):
+    new_path = build_folder_path(folder_id, folders)
+    updated_paths = {}
+
+    for cur_id, cur_folder in folders.items():
+        path = cur_folder.get("path") or build_folder_path(cur_id, folders)
+        path_ids = [entry["folderId"] for entry in path]
+        if folder_id in path_ids:
+            cur_folder["path"] = new_path + path[path_ids.index(folder_id) + 1:]
+            updated_paths[cur_id] = cur_folder["path"]
+
+    return updated_paths
+
+
+def get_folder_sizes(container, files_col):
+    sizes = {"~": 0}
+    size_response = files_col.aggregate([
+        {"$match": {"containerId": container["_id"]}},
+        {"$group": {"_id": "$folder", "size": {"$sum": "$size"}}},
+    ])
+
+    # Roll each folder's own file total up through all of its ancestors
+    for group in size_response:
+        sizes["~"] += group["size"]
+        folder_id = str(group["_id"])
+        if folder_id in container["folders"]:
+            for ancestor in get_path(folder_id, container):
+                sizes[ancestor["folderId"]] = sizes.get(ancestor["folderId"], 0) + group["size"]
+
+    return sizes
+
+
 def get_key_string(container_id, path, name=None):
     return f"{container_id}/project/{'/'.join(path)}{'/' if len(path) > 0 else ''}{name if name else ''}"
 
 
+def run_in_transaction(callback):
+    """
+    Runs callback(session) in a transaction, or without a session on deployments
+    that do not support transactions.
+    """
+    try:
+        with app.db.client.start_session() as session:
+            return session.with_transaction(callback)
+    except OperationFailure as e:
+        # IllegalOperation: transactions require a replica set or mongos
+        if e.code != 20:
+            raise
+        return callback(None)
+
+
+def adjust_container_size(container_id, delta, timestamp, session=None, enforce_limit=True):
+    """
+    Adds delta bytes to the container's size in a single conditional update and
+    returns whether it was applied. Growth past `CONTAINER_SIZE_LIMIT` is rejected
+    unless `enforce_limit` is off, as for rollbacks and corrections that only
+    repair the total; shrinking always applies.
+    """
+    query = {"_id": ObjectId(container_id)}
+    if delta > 0 and enforce_limit:
+        query["size"] = {"$lte": CONTAINER_SIZE_LIMIT - delta}
+
+    result = app.db["containers"].update_one(
+        query,
+        {"$inc": {"size": delta}, "$set": {"lastModified": timestamp}},
+        session=session,
+    )
+    return result.matched_count == 1
+
+
+def get_name_tokens(name):
+    name = name.strip().lower()
+    return sorted({
+        name[start:start + size]
+        for size in range(1, 4)
+        for start in range(len(name) - size + 1)
+    })
+
+
+def get_search_pipeline(match, query, offset, limit=10):
+    """
+    Builds a ranked, paginated name search. Candidates are narrowed through the
+    indexed `nameTokens` field and ranked exact, then prefix, then substring matches.
+    """
+    query = query.strip().lower()
+    if len(query) <= 3:
+        query_tokens = [query]
+    else:
+        query_tokens = sorted({query[start:start + 3] for start in range(len(query) - 2)})
+
+    return [
+        {
+            "$match": {
+                **match,
+                "nameTokens": {"$all": query_tokens},
+                "name": re.compile(re.escape(query), re.IGNORECASE),
+            }
+        },
+        {
+            "$addFields": {
+                "rank": {
+                    "$switch": {
+                        "branches": [
+                            {"case": {"$eq": [{"$toLower": "$name"}, query]}, "then": 0},
+                            {"case": {"$eq": [{"$indexOfCP": [{"$toLower": "$name"}, query]}, 0]}, "then": 1},
+                        ],
+                        "default": 2,
+                    }
+                }
+            }
+        },
+        {"$sort": {"rank": 1, "name": 1, "_id": 1}},
+        {
+            "$facet": {
+                "results": [{"$skip": offset}, {"$limit": limit}],
+                "total": [{"$count": "count"}],
+            }
+        },
+    ]
+
+
+def encode_cursor(ns, object_id):
+    cursor = json.dumps({"ns": ns, "id": str(object_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return values["ns"], ObjectId(values["id"])
+    except Exception:
+        return None
+
+
 def get_folder_id(folderId):
     return folderId if folderId == "~" else ObjectId(folderId)
 
@@ -45,71 +198,254 @@ def rename_s3_object(old_key, new_key):
         "Bucket": S3_BUCKET_NAME, "Key": old_key
     }, new_key)
     source_object.delete()
+    content_cache.pop(old_key)
 
 
-def stream_s3_object(key):
-    s3_object = app.s3.Object(S3_BUCKET_NAME, key)
-    with s3_object.get()["Body"] as body:
-        for chunk in iter(lambda: body.read(4096), b""):
-            yield chunk
+def copy_s3_objects(renames):
+    """
+    Copies (old_key, new_key) pairs concurrently, leaving the old objects in place.
+    Returns the set of old keys that were copied and a dict of old key -> error.
+    """
+    client = app.s3.meta.client
+    renames = [(old_key, new_key) for old_key, new_key in renames if old_key != new_key]
 
+    def copy(rename):
+        old_key, new_key = rename
+        error = None
+        for _ in range(S3_MAX_ATTEMPTS):
+            try:
+                client.copy_object(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=new_key,
+                    CopySource={"Bucket": S3_BUCKET_NAME, "Key": old_key},
+                )
+                return None
+            except Exception as e:
+                error = str(e)
+        return error
 
-def get_all_keys(folder_id, folders, files, seen_folders=None, seen_files=None):
-    if seen_folders is None:
-        seen_folders = set()  
-    if seen_files is None:
-        seen_files = set()  
+    failed = {}
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        for (old_key, _), error in zip(renames, executor.map(copy, renames)):
+            if error:
+                failed[old_key] = error
 
-    if folder_id in seen_folders:
-        return [], []
-    seen_folders.add(folder_id)
+    copied = {old_key for old_key, _ in renames if old_key not in failed}
+    return copied, failed
 
-    current_folder = list(filter(lambda x: x["folderId"] == folder_id, folders))
-    current_files = list(filter(lambda x: x["folder"] == folder_id and x["fileId"] not in seen_files, files))
 
-    for file in current_files:
-        seen_files.add(file["fileId"])
+def put_s3_objects(contents):
+    """
+    Uploads a dict of key -> bytes concurrently. Returns a dict of key -> ETag for
+    the objects written and a dict of key -> error for those that failed.
+    """
+    client = app.s3.meta.client
 
-    child_folders = list(filter(lambda x: x["parent"] == folder_id, folders))
-    for child in child_folders:
-        subfolders, subfiles = get_all_keys(child["folderId"], folders, files, seen_folders, seen_files)
-        current_folder.extend(subfolders)
-        current_files.extend(subfiles)
+    def put(key):
+        error = None
+        for _ in range(S3_MAX_ATTEMPTS):
+            try:
+                response = client.put_object(Bucket=S3_BUCKET_NAME, Key=key, Body=contents[key])
+                return response["ETag"].strip('"'), None
+            except Exception as e:
+                error = str(e)
+        return None, error
 
-    return current_folder, current_files
+    etags = {}
+    failed = {}
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        for key, (etag, error) in zip(contents, executor.map(put, contents)):
+            if error:
+                failed[key] = error
+            else:
+                etags[key] = etag
+    return etags, failed
 
 
-def get_container_contents(containerId, files_col, folders_col):
-    all_files = files_col.find({
-        "containerId": ObjectId(containerId)
-    })
-    all_files = [
+def delete_s3_objects(keys, client=None):
+    """
+    Deletes keys in batches of up to 1000, returning a dict of key -> error.
+    """
+    client = client or app.s3.meta.client
+    failed = {}
+
+    pending = list(keys)
+    for _ in range(S3_MAX_ATTEMPTS):
+        if not pending:
+            break
+
+        failed = {}
+        for start in range(0, len(pending), S3_DELETE_BATCH_SIZE):
+            batch = pending[start:start + S3_DELETE_BATCH_SIZE]
+            try:
+                response = client.delete_objects(
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+            except Exception as e:
+                failed.update({key: str(e) for key in batch})
+                continue
+
+            for error in response.get("Errors", []):
+                failed[error["Key"]] = error.get("Message", error.get("Code"))
+        pending = list(failed)
+
+    for key in keys:
+        content_cache.pop(key)
+
+    return failed
+
+
+def purge_s3_prefix(prefix):
+    """
+    Deletes every object under a prefix, one listing page at a time, with the
+    page deletes spread across a worker pool. At most `S3_MAX_WORKERS` pages are
+    in flight, so listing stays just ahead of deleting. Returns a dict of key -> error.
+    """
+    client = app.s3.meta.client
+    paginator = client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=S3_BUCKET_NAME,
+        Prefix=prefix,
+        PaginationConfig={"PageSize": S3_DELETE_BATCH_SIZE},
+    )
+
+    failed = {}
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        pending = deque()
+        for page in pages:
+            if not page.get("Contents"):
+                continue
+            if len(pending) >= S3_MAX_WORKERS:
+                failed.update(pending.popleft().result())
+            pending.append(executor.submit(
+                delete_s3_objects, [obj["Key"] for obj in page["Contents"]], client
+            ))
+        for future in pending:
+            failed.update(future.result())
+    return failed
+
+
+def get_chunk_size(length):
+    """
+    Objects up to `S3_STREAM_CHUNK_MAX` bytes are read in a single chunk; larger
+    ones in chunks of that size.
+    """
+    return max(S3_STREAM_CHUNK_MIN, min(length or 0, S3_STREAM_CHUNK_MAX))
+
+
+def get_s3_object(key, byte_range=None, etag=None):
+    """
+    Issues the GET for an object, optionally for a (start, stop) byte range with stop
+    exclusive, or conditional on its ETag. Returns None if S3 answers 304.
+    """
+    kwargs = {}
+    if byte_range:
+        kwargs["Range"] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+    if etag:
+        kwargs["IfNoneMatch"] = etag
+
+    try:
+        return app.s3.Object(S3_BUCKET_NAME, key).get(**kwargs)
+    except ClientError as e:
+        if e.response["ResponseMetadata"]["HTTPStatusCode"] == 304:
+            return None
+        raise
+
+
+def stream_file_contents(client, file_ids, files, boundary):
+    """
+    Yields a multipart/mixed body with one part per requested file ID, in request
+    order. `files` maps file IDs to their documents; IDs missing from it get an empty
+    part with `X-Status: 404`. Contents come from the content cache or are fetched
+    from S3 on a worker pool.
+    """
+    def read(file):
+        content = content_cache.get(file["key"], file.get("etag")) if file.get("etag") else None
+        if content is not None:
+            return file.get("etag"), content
+
+        error = None
+        for _ in range(S3_MAX_ATTEMPTS):
+            try:
+                response = client.get_object(Bucket=S3_BUCKET_NAME, Key=file["key"])
+                etag = response["ETag"].strip('"')
+                content = response["Body"].read()
+                content_cache.set(file["key"], etag, content)
+                return etag, content
+            except Exception as e:
+                error = e
+        raise error
+
+    def get_part(file_id, headers, content=b""):
+        lines = [f"--{boundary}", f"Content-ID: <{file_id}>", *headers, f"Content-Length: {len(content)}"]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode() + content + b"\r\n"
+
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        reads = {
+            file_id: executor.submit(read, files[file_id])
+            for file_id in file_ids
+            if file_id in files
+        }
+        for file_id in file_ids:
+            if file_id not in reads:
+                yield get_part(file_id, ["X-Status: 404"])
+                continue
+
+            try:
+                etag, content = reads[file_id].result()
+            except Exception:
+                yield get_part(file_id, ["X-Status: 500"])
+                continue
+            yield get_part(
+                file_id,
+                ["Content-Type: application/octet-stream", f'ETag: "{etag}"', "X-Status: 200"],
+                content,
+            )
+
+    yield f"--{boundary}--\r\n".encode()
+
+
+def stream_s3_object(s3_response):
+    chunk_size = get_chunk_size(s3_response.get("ContentLength"))
+    with s3_response["Body"] as body:
+        for chunk in iter(lambda: body.read(chunk_size), b""):
+            yield chunk
+
+
+def get_subtree(folder_id, container, files_col):
+    children = {}
+    for cur_id, cur_folder in container["folders"].items():
+        children.setdefault(cur_folder["parent"], []).append(cur_id)
+
+    subtree_folders = []
+    seen_folders = set()
+    pending = [folder_id]
+    while pending:
+        cur_id = pending.pop()
+        if cur_id in seen_folders:
+            continue
+        seen_folders.add(cur_id)
+        subtree_folders.append(cur_id)
+        pending.extend(children.get(cur_id, []))
+
+    subtree_files = files_col.find(
+        {
+            "containerId": container["_id"],
+            "folder": {"$in": [get_folder_id(cur_id) for cur_id in subtree_folders]},
+        },
+        {"folder": 1, "key": 1, "name": 1, "size": 1, "lastModified": 1},
+    )
+    subtree_files = [
         {
             "fileId": str(file["_id"]),
-            "containerId": str(file["containerId"]),
-            "createdBy": file["createdBy"],
             "folder": str(file["folder"]),
             "key": file["key"],
             "name": file["name"],
-            "created": str(file["created"]),
-            "lastModified": str(file["lastModified"]),
-        }
-        for file in all_files
-    ]
-
-    all_folders = folders_col.find({
-        "containerId": ObjectId(containerId)
-    })
-    all_folders = [
-        {
-            "folderId": str(directory["_id"]),
-            "containerId": str(directory["containerId"]),
-            "parent": str(directory["parent"]),
-            "name": directory["name"],
-            "created": str(directory["created"]),
-            "lastModified": str(directory["lastModified"]),
+            "size": file["size"],
+            "lastModified": file["lastModified"],
         }
-        for directory in all_folders
+        for file in subtree_files
     ]
 
-    return all_files, all_folders
\ No newline at end of file
+    return subtree_folders, subtree_files
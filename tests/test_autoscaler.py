@@ -0,0 +1,139 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from cloudcontain_api.autoscaler import DemandModel, NodeAutoscaler
+from cloudcontain_api.utils.constants import NODE_IDLE_TIMEOUT, NODE_LAUNCH_TIMEOUT
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class FakeEC2:
+    """
+    Keeps one instance per ClientToken, as EC2 does for idempotent launches.
+    """
+
+    def __init__(self):
+        self.instances = {}
+        self.terminated = []
+        self.fail_launches = False
+        self.lose_responses = False
+
+    def run_instances(self, ClientToken, **kwargs):
+        if self.fail_launches:
+            raise RuntimeError("EC2 unavailable")
+        instance_id = self.instances.setdefault(ClientToken, f"i-{len(self.instances)}")
+        if self.lose_responses:
+            raise TimeoutError("Response lost")
+        return {"Instances": [{"InstanceId": instance_id}]}
+
+    def describe_instances(self, Filters):
+        tokens = next(f["Values"] for f in Filters if f["Name"] == "client-token")
+        return {
+            "Reservations": [
+                {"Instances": [{"InstanceId": self.instances[token]}]}
+                for token in tokens
+                if token in self.instances and self.instances[token] not in self.terminated
+            ]
+        }
+
+    def terminate_instances(self, InstanceIds):
+        self.terminated += InstanceIds
+
+
+@unittest.skipUnless(mongomock, "mongomock is not installed")
+class NodeAutoscalerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.ec2 = FakeEC2()
+        self.now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def make_autoscaler(self):
+        return NodeAutoscaler(self.db, self.ec2, warm_min=0, model=DemandModel())
+
+    def queue_jobs(self, count):
+        self.db["jobs"].insert_many([{"status": "PENDING", "node": None} for _ in range(count)])
+
+    def test_launches_for_queue(self):
+        self.queue_jobs(25)
+        launched, terminated = self.make_autoscaler().step(self.now)
+
+        self.assertEqual((launched, terminated), (2, 0))
+        self.assertEqual(len(self.ec2.instances), 2)
+        self.assertEqual(self.db["nodes"].count_documents({"instanceId": {"$ne": None}}), 2)
+
+    def test_failed_launch_is_retried_with_same_token(self):
+        self.queue_jobs(1)
+        autoscaler = self.make_autoscaler()
+
+        self.ec2.fail_launches = True
+        autoscaler.step(self.now)
+        self.ec2.fail_launches = False
+        launched, _ = autoscaler.step(self.now + timedelta(seconds=10))
+
+        node = self.db["nodes"].find_one()
+        self.assertEqual(launched, 0)
+        self.assertEqual(list(self.ec2.instances), [str(node["_id"])])
+        self.assertEqual(node["instanceId"], "i-0")
+
+    def test_only_lease_holder_acts(self):
+        self.queue_jobs(1)
+        first, second = self.make_autoscaler(), self.make_autoscaler()
+
+        self.assertEqual(first.step(self.now), (1, 0))
+        self.assertEqual(second.step(self.now), (0, 0))
+        self.assertEqual(self.db["nodes"].count_documents({}), 1)
+
+    def test_stalled_launch_with_lost_response_is_terminated(self):
+        self.queue_jobs(1)
+        autoscaler = self.make_autoscaler()
+
+        self.ec2.lose_responses = True
+        autoscaler.step(self.now)
+        self.assertEqual(self.db["nodes"].find_one()["instanceId"], None)
+
+        self.db["jobs"].delete_many({})
+        later = self.now + timedelta(seconds=NODE_LAUNCH_TIMEOUT + 1)
+        _, terminated = autoscaler.step(later)
+
+        self.assertEqual(terminated, 1)
+        self.assertEqual(self.ec2.terminated, ["i-0"])
+        self.assertEqual(self.db["nodes"].count_documents({}), 0)
+
+    def test_idle_nodes_are_retired_after_timeout(self):
+        self.queue_jobs(1)
+        autoscaler = self.make_autoscaler()
+        autoscaler.step(self.now)
+        self.db["nodes"].update_many({}, {"$set": {"alive": True, "pending": False}})
+        self.db["jobs"].update_many({}, {"$set": {"status": "COMPLETED"}})
+
+        self.assertEqual(autoscaler.step(self.now + timedelta(seconds=10)), (0, 0))
+        later = self.now + timedelta(seconds=10 + NODE_IDLE_TIMEOUT)
+        self.assertEqual(autoscaler.step(later), (0, 1))
+        self.assertEqual(self.ec2.terminated, ["i-0"])
+        self.assertEqual(self.db["nodes"].count_documents({}), 0)
+
+    def test_nodes_running_jobs_are_never_retired(self):
+        self.queue_jobs(1)
+        autoscaler = self.make_autoscaler()
+        autoscaler.step(self.now)
+        node = self.db["nodes"].find_one()
+        self.db["nodes"].update_many({}, {"$set": {"alive": True, "pending": False}})
+        self.db["jobs"].delete_many({})
+
+        for name in (node["_id"], str(node["_id"]), node["instanceId"]):
+            with self.subTest(node=name):
+                self.db["jobs"].delete_many({})
+                self.db["jobs"].insert_one({"status": "RUNNING", "node": name})
+
+                later = self.now + timedelta(seconds=10 * NODE_IDLE_TIMEOUT)
+                self.assertEqual(autoscaler.step(later), (0, 0))
+                self.assertEqual(self.ec2.terminated, [])
+                self.assertIsNone(self.db["nodes"].find_one()["idleSince"])
+
+
+if __name__ == "__main__":
+    unittest.main()